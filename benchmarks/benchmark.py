@@ -0,0 +1,341 @@
+"""Benchmarks radarqc on synthetic Cross-Spectrum files.
+
+Reports throughput (files/s, MB/s) and peak memory for loading, dumping,
+header-only parsing, DataSet construction, every SignalProcessor, every
+SpectrumFilter and MUSIC direction finding.  Results can be saved as a
+baseline, and later runs compared against it to catch regressions.  A
+baseline is only compared against runs of the same workload."""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from radarqc import csfile, direction, synthetic
+from radarqc.dataset import DataSet
+from radarqc.filtering import NoiseFilter, PCAFilter, PreFitPCAFilter
+from radarqc.processing import (
+    Abs,
+    CompositeProcessor,
+    GainCalculator,
+    Identity,
+    Normalize,
+    Rectifier,
+)
+
+_MB = 1024 * 1024
+
+# Arguments that change what is measured, and must match a baseline's
+_WORKLOAD = (
+    "num_files",
+    "range_cells",
+    "doppler_cells",
+    "cskind",
+    "num_components",
+    "seed",
+)
+
+
+class Benchmark:
+    """A named workload, processing `num_files` items totalling `num_bytes`
+    bytes every time `run` is called"""
+
+    def __init__(
+        self, name: str, run: Callable, num_files: int, num_bytes: int
+    ) -> None:
+        self.name = name
+        self.run = run
+        self.num_files = num_files
+        self.num_bytes = num_bytes
+
+    def measure(self, repeat: int) -> Dict[str, float]:
+        best = min(self._time() for _ in range(repeat))
+        return {
+            "files_per_s": self.num_files / best,
+            "mb_per_s": self.num_bytes / _MB / best,
+            "peak_mb": self._peak_memory() / _MB,
+        }
+
+    def _time(self) -> float:
+        start = time.perf_counter()
+        self.run()
+        return time.perf_counter() - start
+
+    def _peak_memory(self) -> int:
+        tracemalloc.start()
+        try:
+            self.run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
+
+
+def create_files(directory: str, args: argparse.Namespace) -> List[str]:
+    paths = []
+    for i in range(args.num_files):
+        path = os.path.join(directory, "CSS_SYNT_{:04d}.cs".format(i))
+        with open(path, "wb") as f:
+            synthetic.write(
+                f,
+                num_range_cells=args.range_cells,
+                num_doppler_cells=args.doppler_cells,
+                cskind=args.cskind,
+                seed=args.seed + i,
+            )
+        paths.append(path)
+    return paths
+
+
+def _load_all(paths: List[str], preprocess=None) -> List[csfile.CSFile]:
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append(csfile.load(f, preprocess))
+    return files
+
+
+def _load_headers(paths: List[str]) -> int:
+    num_bytes = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            csfile.load_header(f)
+            num_bytes += f.tell()
+    return num_bytes
+
+
+def _dump_all(files: List[csfile.CSFile]) -> None:
+    for cs in files:
+        csfile.dump(cs, io.BytesIO())
+
+
+def _apply(fn: Callable, arrays: List[np.ndarray]) -> None:
+    for array in arrays:
+        fn(array)
+
+
+def create_benchmarks(
+    paths: List[str], args: argparse.Namespace
+) -> List[Benchmark]:
+    num_files = len(paths)
+    file_bytes = sum(os.path.getsize(path) for path in paths)
+    header_bytes = _load_headers(paths)
+    preprocess = CompositeProcessor(
+        Abs(), GainCalculator(reference=34.2), Normalize()
+    )
+
+    raw = _load_all(paths)
+    raw_spectra = [cs.antenna3 for cs in raw]
+    spectrum_bytes = sum(spectrum.nbytes for spectrum in raw_spectra)
+    dataset = DataSet(paths, preprocess)
+    spectra = list(dataset.spectra)
+
+    benchmarks = [
+        Benchmark(
+            "csfile.load", lambda: _load_all(paths), num_files, file_bytes
+        ),
+        Benchmark("csfile.dump", lambda: _dump_all(raw), num_files, file_bytes),
+        Benchmark(
+            "csfile.load_header",
+            lambda: _load_headers(paths),
+            num_files,
+            header_bytes,
+        ),
+        Benchmark(
+            "DataSet",
+            lambda: DataSet(paths, preprocess),
+            num_files,
+            file_bytes,
+        ),
+    ]
+
+    processors = [
+        Identity(),
+        Abs(),
+        Rectifier(),
+        GainCalculator(reference=34.2),
+        Normalize(),
+        preprocess,
+    ]
+    for processor in processors:
+        name = "processing.{}".format(processor.__class__.__name__)
+        benchmarks.append(
+            Benchmark(
+                name,
+                lambda p=processor: _apply(p, raw_spectra),
+                num_files,
+                spectrum_bytes,
+            )
+        )
+
+    filters = [
+        NoiseFilter(threshold=0.18, window_std=0.02),
+        PCAFilter(num_components=args.num_components),
+        PreFitPCAFilter(dataset.spectra, args.num_components),
+    ]
+    for spectrum_filter in filters:
+        name = "filtering.{}".format(spectrum_filter.__class__.__name__)
+        benchmarks.append(
+            Benchmark(
+                name,
+                lambda f=spectrum_filter: _apply(f, spectra),
+                num_files,
+                dataset.spectra.nbytes,
+            )
+        )
+
+    pattern = direction.AntennaPattern.ideal()
+    benchmarks.append(
+        Benchmark(
+            "direction.music",
+            lambda: [
+                direction.estimate_bearings(cs.spectrum, pattern) for cs in raw
+            ],
+            num_files,
+            sum(cs.spectrum.nbytes for cs in raw),
+        )
+    )
+    return benchmarks
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Returns a description of every benchmark that got slower, or used
+    more memory, than the baseline by more than the given fraction"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result["files_per_s"] < expected["files_per_s"] * (1 - tolerance):
+            regressions.append(
+                "{}: {:.1f} files/s, baseline {:.1f} files/s".format(
+                    name, result["files_per_s"], expected["files_per_s"]
+                )
+            )
+        if result["peak_mb"] > expected["peak_mb"] * (1 + tolerance):
+            regressions.append(
+                "{}: {:.2f} MB peak, baseline {:.2f} MB peak".format(
+                    name, result["peak_mb"], expected["peak_mb"]
+                )
+            )
+    return regressions
+
+
+def config_mismatches(
+    config: Dict[str, object], args: argparse.Namespace
+) -> List[str]:
+    """Describes every workload setting that differs between a saved
+    baseline config and the current arguments"""
+    mismatches = []
+    for key in _WORKLOAD:
+        value = getattr(args, key)
+        if config.get(key) != value:
+            mismatches.append(
+                "--{} {}, baseline {}".format(
+                    key.replace("_", "-"), value, config.get(key)
+                )
+            )
+    return mismatches
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    line = "{:<30} {:>12} {:>10} {:>10}"
+    print(line.format("benchmark", "files/s", "MB/s", "peak MB"))
+    print("-" * 65)
+    for name, result in results.items():
+        print(
+            line.format(
+                name,
+                "{:.1f}".format(result["files_per_s"]),
+                "{:.1f}".format(result["mb_per_s"]),
+                "{:.2f}".format(result["peak_mb"]),
+            )
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-files", type=int, default=16)
+    parser.add_argument("--range-cells", type=int, default=32)
+    parser.add_argument("--doppler-cells", type=int, default=512)
+    parser.add_argument("--cskind", type=int, default=2)
+    parser.add_argument("--num-components", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="timed runs per benchmark, the fastest is reported",
+    )
+    parser.add_argument(
+        "--filter",
+        default="",
+        help="only run benchmarks whose name contains this string",
+    )
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed fractional slowdown before reporting a regression",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatches = config_mismatches(baseline.get("config", {}), args)
+        if mismatches:
+            sys.exit(
+                "Baseline was run with a different workload: "
+                + "; ".join(mismatches)
+            )
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_files(directory, args)
+        benchmarks = create_benchmarks(paths, args)
+        results = {
+            benchmark.name: benchmark.measure(args.repeat)
+            for benchmark in benchmarks
+            if args.filter in benchmark.name
+        }
+    print_results(results)
+
+    if args.save:
+        config = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("save", "baseline", "filter")
+        }
+        config["python"] = platform.python_version()
+        config["numpy"] = np.__version__
+        with open(args.save, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Checks the import time of radarqc modules against a fixed budget.
+
+Each module is imported in a fresh interpreter with `-X importtime`, so
+the measurement includes everything the module pulls in (numpy included).
+Exits with a non-zero status if any module exceeds its budget."""
+
+import argparse
+import subprocess
+import sys
+
+from typing import Dict, Iterable
+
+# Cumulative import time budget in milliseconds
+BUDGETS_MS = {
+    "radarqc.csfile": 250.0,
+    "radarqc.filtering": 250.0,
+}
+
+# Modules that must never be imported as a side effect of the above
+FORBIDDEN = ("scipy", "sklearn")
+
+
+def measure_import(module: str) -> Dict[str, float]:
+    """Returns the cumulative import time in milliseconds of every
+    module imported while importing the given module"""
+    cmd = [sys.executable, "-X", "importtime", "-c", "import " + module]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return _parse_importtime(result.stderr.splitlines())
+
+
+def _parse_importtime(lines: Iterable[str]) -> Dict[str, float]:
+    timings = {}
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        try:
+            timings[name.strip()] = int(cumulative) / 1000
+        except ValueError:
+            continue  # column titles
+    return timings
+
+
+def check_budget(module: str, budget_ms: float, repeat: int) -> bool:
+    best, imported = None, {}
+    for _ in range(repeat):
+        imported = measure_import(module)
+        elapsed = imported[module]
+        best = elapsed if best is None else min(best, elapsed)
+
+    forbidden = sorted(
+        name for name in imported if name.split(".")[0] in FORBIDDEN
+    )
+    ok = best <= budget_ms and not forbidden
+    status = "OK" if ok else "FAIL"
+    print(
+        "{:<24} {:>8.1f} ms (budget {:.1f} ms) {}".format(
+            module, best, budget_ms, status
+        )
+    )
+    if forbidden:
+        print("  imports forbidden modules: {}".format(", ".join(forbidden)))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of fresh interpreters per module, best time is kept",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiplier applied to every budget, for slow machines",
+    )
+    args = parser.parse_args()
+
+    results = [
+        check_budget(module, budget * args.scale, args.repeat)
+        for module, budget in BUDGETS_MS.items()
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""Chunked, compressed archive of Cross-Spectrum time series.
+
+Each channel is stored as a (time, range, doppler) array split into chunks
+along the time and range axes, each chunk compressed with zlib or lzma.
+Header fields are stored as one array per field.  Reading a window of the
+archive only decompresses the chunks it overlaps.
+
+Layout of an archive directory:
+
+    meta.json                  shapes, chunking, codec and channel dtypes
+    headers.npz                one array per header field
+    blocks.pkl                 v6 header blocks of every file
+    <channel>/t<i>_r<j>.chunk  compressed chunk (i, j) of each channel"""
+
+import collections
+import datetime
+import json
+import lzma
+import os
+import pickle
+import zlib
+
+from typing import Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.header import CSFileHeader
+from radarqc.processing import Identity, SignalProcessor
+
+_REAL_CHANNELS = ("antenna1", "antenna2", "antenna3")
+_COMPLEX_CHANNELS = ("cross12", "cross13", "cross23")
+_QUALITY_CHANNEL = "quality"
+
+HEADER_FIELDS = (
+    "version",
+    "timestamp",
+    "cskind",
+    "site_code",
+    "cover_minutes",
+    "deleted_source",
+    "override_source",
+    "start_freq_mhz",
+    "rep_freq_mhz",
+    "bandwidth_khz",
+    "sweep_up",
+    "num_doppler_cells",
+    "num_range_cells",
+    "first_range_cell",
+    "range_cell_dist_km",
+    "output_interval",
+    "create_type_code",
+    "creator_version",
+    "num_active_channels",
+    "num_spectra_channels",
+    "active_channels",
+)
+_STRING_FIELDS = ("site_code", "create_type_code", "creator_version")
+
+
+class _Codec:
+    """Compresses chunks, after shuffling the bytes of each value so that
+    bytes with the same significance are stored next to each other, which
+    makes floating point data far more compressible"""
+
+    def __init__(self, name: str, level: int, shuffle: bool) -> None:
+        if name not in ("zlib", "lzma", "none"):
+            raise ValueError("Unknown compression: {}".format(name))
+        self.name = name
+        self.level = level
+        self.shuffle = shuffle
+
+    def encode(self, array: np.ndarray) -> bytes:
+        data = np.ascontiguousarray(array)
+        if self.shuffle:
+            data = data.view(np.uint8).reshape(-1, data.dtype.itemsize).T
+        raw = np.ascontiguousarray(data).tobytes()
+        if self.name == "zlib":
+            return zlib.compress(raw, self.level)
+        if self.name == "lzma":
+            return lzma.compress(raw, preset=self.level)
+        return raw
+
+    def decode(self, buff: bytes, dtype: np.dtype, shape: tuple) -> np.ndarray:
+        if self.name == "zlib":
+            buff = zlib.decompress(buff)
+        elif self.name == "lzma":
+            buff = lzma.decompress(buff)
+        data = np.frombuffer(buff, dtype=np.uint8)
+        if self.shuffle:
+            data = data.reshape(dtype.itemsize, -1).T.copy()
+        return data.view(dtype).reshape(shape)
+
+
+def _chunk_name(time_chunk: int, range_chunk: int) -> str:
+    return "t{:06d}_r{:04d}.chunk".format(time_chunk, range_chunk)
+
+
+def _encode_strings(field: str, values: List[str]) -> np.ndarray:
+    """Stores fixed-width string fields as rows of raw bytes, since numpy
+    string arrays drop trailing NULs and the field would lose its width"""
+    encoded = [value.encode() for value in values]
+    widths = {len(value) for value in encoded}
+    if len(widths) > 1:
+        raise ValueError("Values of {} differ in width".format(field))
+    width = widths.pop() if widths else 0
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8).reshape(-1, width)
+
+
+def _decode_strings(column: np.ndarray) -> np.ndarray:
+    if column.dtype != np.uint8:
+        return column  # written as a numpy string array by older exports
+    decoded = np.empty(len(column), dtype=object)
+    decoded[:] = [row.tobytes().decode() for row in column]
+    return decoded
+
+
+def _header_columns(headers: List[CSFileHeader]) -> dict:
+    columns = {}
+    for field in HEADER_FIELDS:
+        values = [getattr(header, field) for header in headers]
+        if field == "timestamp":
+            columns[field] = np.array(values, dtype="datetime64[us]")
+        elif field in _STRING_FIELDS:
+            columns[field] = _encode_strings(field, values)
+        else:
+            columns[field] = np.array(values)
+    return columns
+
+
+class _ChunkWriter:
+    """Buffers one time chunk of every channel, compressing and writing it
+    to disk when full, so export memory does not grow with the number of
+    files"""
+
+    def __init__(
+        self,
+        directory: str,
+        channels: dict,
+        shape: Tuple[int, int],
+        chunks: Tuple[int, int],
+        codec: _Codec,
+    ) -> None:
+        self._directory = directory
+        self._codec = codec
+        self._chunks = chunks
+        self._buffers = {
+            name: np.empty((chunks[0],) + shape, dtype=dtype)
+            for name, dtype in channels.items()
+        }
+        for name in channels:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        self._num_buffered = 0
+        self._time_chunk = 0
+
+    def append(self, spectra: dict) -> None:
+        for name, buff in self._buffers.items():
+            buff[self._num_buffered] = spectra[name]
+        self._num_buffered += 1
+        if self._num_buffered == self._chunks[0]:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._num_buffered == 0:
+            return
+        num_range = next(iter(self._buffers.values())).shape[1]
+        range_chunk = self._chunks[1]
+        for name, buff in self._buffers.items():
+            for j, start in enumerate(range(0, num_range, range_chunk)):
+                chunk = buff[: self._num_buffered, start : start + range_chunk]
+                path = os.path.join(
+                    self._directory, name, _chunk_name(self._time_chunk, j)
+                )
+                with open(path, "wb") as f:
+                    f.write(self._codec.encode(chunk))
+        self._num_buffered = 0
+        self._time_chunk += 1
+
+
+def _load(path: str, preprocess: SignalProcessor) -> csfile.CSFile:
+    with open(path, "rb") as f:
+        return csfile.load(f, preprocess)
+
+
+def _read_header(path: str) -> CSFileHeader:
+    with open(path, "rb") as f:
+        return csfile.load_header(f)
+
+
+def export(
+    paths: Iterable[str],
+    directory: str,
+    time_chunk: int = 24,
+    range_chunk: int = 8,
+    compression: str = "zlib",
+    level: int = 6,
+    shuffle: bool = True,
+    preprocess: SignalProcessor = None,
+) -> "Archive":
+    """Converts Cross-Spectrum files into an archive, ordered by header
+    timestamp.  All files must have the same number of range and doppler
+    cells, and either all or none of them may contain quality data"""
+    if preprocess is None:
+        preprocess = Identity()
+
+    headers = [(_read_header(path), path) for path in paths]
+    if not headers:
+        raise ValueError("No files to export")
+    headers.sort(key=lambda item: item[0].timestamp)
+    first = headers[0][0]
+    shape = (first.num_range_cells, first.num_doppler_cells)
+    has_quality = first.cskind >= 2
+    for header, path in headers:
+        if (header.num_range_cells, header.num_doppler_cells) != shape:
+            raise ValueError("Spectrum shape of {} differs".format(path))
+        if (header.cskind >= 2) != has_quality:
+            raise ValueError("Quality data of {} differs".format(path))
+
+    channels = collections.OrderedDict()
+    for name in _REAL_CHANNELS:
+        channels[name] = np.dtype(np.float32)
+    for name in _COMPLEX_CHANNELS:
+        channels[name] = np.dtype(np.complex64)
+    if has_quality:
+        channels[_QUALITY_CHANNEL] = np.dtype(np.float32)
+
+    os.makedirs(directory, exist_ok=True)
+    codec = _Codec(compression, level, shuffle)
+    chunks = (time_chunk, min(range_chunk, shape[0]))
+    writer = _ChunkWriter(directory, channels, shape, chunks, codec)
+    loaded = []
+    for _, path in headers:
+        cs = _load(path, preprocess)
+        spectra = {name: getattr(cs.spectrum, name) for name in channels}
+        writer.append(spectra)
+        loaded.append(cs.header)
+    writer.flush()
+
+    np.savez(os.path.join(directory, "headers.npz"), **_header_columns(loaded))
+    with open(os.path.join(directory, "blocks.pkl"), "wb") as f:
+        pickle.dump([dict(header.blocks) for header in loaded], f)
+
+    meta = {
+        "num_times": len(loaded),
+        "shape": list(shape),
+        "chunks": list(chunks),
+        "compression": compression,
+        "shuffle": shuffle,
+        "channels": {name: dtype.str for name, dtype in channels.items()},
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return Archive(directory)
+
+
+def _normalize_index(key, length: int) -> Tuple[np.ndarray, bool]:
+    """Converts an int or slice into the selected indices, and whether the
+    axis should be dropped from the result"""
+    if isinstance(key, slice):
+        return np.arange(*key.indices(length)), False
+    if isinstance(key, (int, np.integer)):
+        index = int(key)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("index {} is out of bounds".format(key))
+        return np.array([index]), True
+    raise TypeError("Only integers and slices are supported on this axis")
+
+
+class ArchiveChannel:
+    """Lazy (time, range, doppler) array of one channel in an archive.
+    Indexing with integers or slices reads and decompresses only the chunks
+    that overlap the selection"""
+
+    def __init__(self, archive: "Archive", name: str) -> None:
+        self._archive = archive
+        self._name = name
+        self.dtype = archive.channel_dtype(name)
+        self.shape = (archive.num_times,) + archive.spectrum_shape
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self[:]
+        return array if dtype is None else array.astype(dtype)
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError("too many indices")
+        key = key + (slice(None),) * (3 - len(key))
+        times, drop_time = _normalize_index(key[0], self.shape[0])
+        ranges, drop_range = _normalize_index(key[1], self.shape[1])
+
+        out = np.empty((len(times), len(ranges), self.shape[2]), self.dtype)
+        time_chunk, range_chunk = self._archive.chunks
+        time_ids, range_ids = times // time_chunk, ranges // range_chunk
+        for i in np.unique(time_ids):
+            time_mask = time_ids == i
+            chunk_times = times[time_mask] - i * time_chunk
+            for j in np.unique(range_ids):
+                range_mask = range_ids == j
+                chunk = self._archive.read_chunk(self._name, i, j)
+                selected = chunk[
+                    np.ix_(chunk_times, ranges[range_mask] - j * range_chunk)
+                ]
+                out[np.ix_(time_mask, range_mask)] = selected
+
+        out = out[..., key[2]]
+        if drop_range:
+            out = out[:, 0]
+        if drop_time:
+            out = out[0]
+        return out
+
+
+class ArchiveHeaders(Sequence):
+    """Sequence of CSFileHeader, built on access from the header columns"""
+
+    def __init__(self, columns: dict, blocks: List[dict]) -> None:
+        self._columns = columns
+        self._blocks = blocks
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        header = CSFileHeader()
+        for field in HEADER_FIELDS:
+            value = self._columns[field][i]
+            if isinstance(value, np.generic):
+                value = value.item()
+            setattr(header, field, value)
+        header.blocks = collections.OrderedDict(self._blocks[i])
+        return header
+
+
+class Archive:
+    """Reader for archives written by `export`"""
+
+    def __init__(self, directory: str, cache_chunks: int = 16) -> None:
+        self._directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self._meta = json.load(f)
+        self._codec = _Codec(
+            self._meta["compression"], level=0, shuffle=self._meta["shuffle"]
+        )
+        self._columns = None
+        self._blocks = None
+        self._cache = collections.OrderedDict()
+        self._cache_chunks = cache_chunks
+
+    @property
+    def num_times(self) -> int:
+        return self._meta["num_times"]
+
+    @property
+    def spectrum_shape(self) -> Tuple[int, int]:
+        """(num_range, num_doppler) of every spectrum in the archive"""
+        return tuple(self._meta["shape"])
+
+    @property
+    def chunks(self) -> Tuple[int, int]:
+        """Number of times and range cells in each chunk"""
+        return tuple(self._meta["chunks"])
+
+    @property
+    def channels(self) -> List[str]:
+        return list(self._meta["channels"])
+
+    def channel_dtype(self, name: str) -> np.dtype:
+        return np.dtype(self._meta["channels"][name])
+
+    def channel(self, name: str) -> ArchiveChannel:
+        if name not in self._meta["channels"]:
+            raise KeyError("No channel named {}".format(name))
+        return ArchiveChannel(self, name)
+
+    def header_column(self, field: str) -> np.ndarray:
+        """Values of a header field for every time, e.g. "timestamp" """
+        if self._columns is None:
+            path = os.path.join(self._directory, "headers.npz")
+            with np.load(path) as columns:
+                self._columns = dict(columns)
+            for name in _STRING_FIELDS:
+                self._columns[name] = _decode_strings(self._columns[name])
+        return self._columns[field]
+
+    @property
+    def times(self) -> np.ndarray:
+        """Timestamps as datetime64, in ascending order"""
+        return self.header_column("timestamp")
+
+    @property
+    def headers(self) -> ArchiveHeaders:
+        if self._blocks is None:
+            with open(os.path.join(self._directory, "blocks.pkl"), "rb") as f:
+                self._blocks = pickle.load(f)
+        columns = {field: self.header_column(field) for field in HEADER_FIELDS}
+        return ArchiveHeaders(columns, self._blocks)
+
+    def time_slice(
+        self,
+        start: Union[datetime.datetime, np.datetime64] = None,
+        end: Union[datetime.datetime, np.datetime64] = None,
+    ) -> slice:
+        """Slice selecting all times in the half-open range [start, end)"""
+        times = self.times
+        i = 0 if start is None else np.searchsorted(times, np.datetime64(start))
+        j = (
+            len(times)
+            if end is None
+            else np.searchsorted(times, np.datetime64(end))
+        )
+        return slice(int(i), int(j))
+
+    def read(
+        self,
+        channel: str,
+        start: datetime.datetime = None,
+        end: datetime.datetime = None,
+        ranges: slice = slice(None),
+    ) -> np.ndarray:
+        """Reads a channel for the times in [start, end) and a window of
+        range cells"""
+        return self.channel(channel)[self.time_slice(start, end), ranges]
+
+    def read_chunk(
+        self, channel: str, time_chunk: int, range_chunk: int
+    ) -> np.ndarray:
+        key = (channel, int(time_chunk), int(range_chunk))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        num_times, num_range = self.num_times, self.spectrum_shape[0]
+        times, ranges = self.chunks
+        shape = (
+            min(times, num_times - key[1] * times),
+            min(ranges, num_range - key[2] * ranges),
+            self.spectrum_shape[1],
+        )
+        path = os.path.join(self._directory, channel, _chunk_name(*key[1:]))
+        with open(path, "rb") as f:
+            chunk = self._codec.decode(
+                f.read(), self.channel_dtype(channel), shape
+            )
+
+        self._cache[key] = chunk
+        if len(self._cache) > self._cache_chunks:
+            self._cache.popitem(last=False)
+        return chunk
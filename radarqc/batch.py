@@ -0,0 +1,341 @@
+"""Batch processing of Cross-Spectrum files.
+
+Every file below the input directory is loaded with the configured
+preprocessing, filtered, and written with the same relative path below the
+output directory.  Finished files are recorded in a manifest, so rerunning
+the same command after an interruption only processes the remaining files.
+
+The processing chain is described by a JSON config file, e.g.
+
+{
+    "preprocess": [
+        {"type": "Abs"},
+        {"type": "GainCalculator", "reference": 34.2},
+        {"type": "Normalize"}
+    ],
+    "filters": [
+        {"type": "PCAFilter", "num_components": 0.8},
+        {"type": "NoiseFilter", "threshold": 0.18, "window_std": 0.02}
+    ],
+    "channels": ["antenna3"]
+}
+
+"type" names a class from radarqc.processing or radarqc.filtering, and the
+remaining keys are passed to its constructor."""
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+from typing import Iterable, List, Tuple
+
+from radarqc import csfile, filtering, processing
+from radarqc.filtering import CompositeFilter, SpectrumFilter
+from radarqc.processing import CompositeProcessor, SignalProcessor
+
+MANIFEST_NAME = ".radarqc-batch-manifest.jsonl"
+
+_FILTERABLE_CHANNELS = ("antenna1", "antenna2", "antenna3")
+
+
+def _build(module, base: type, spec: dict):
+    spec = dict(spec)
+    name = spec.pop("type")
+    cls = getattr(module, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, base)):
+        raise ValueError("Unknown {}: {}".format(base.__name__, name))
+    return cls(**spec)
+
+
+def build_processor(specs: Iterable[dict]) -> SignalProcessor:
+    """Builds a CompositeProcessor from a list of processor specs"""
+    processors = [_build(processing, SignalProcessor, spec) for spec in specs]
+    return CompositeProcessor(*processors)
+
+
+def build_filter(specs: Iterable[dict]) -> SpectrumFilter:
+    """Builds a CompositeFilter from a list of filter specs"""
+    filters = [_build(filtering, SpectrumFilter, spec) for spec in specs]
+    return CompositeFilter(*filters)
+
+
+class BatchConfig:
+    """Declarative description of the processing applied to each file"""
+
+    def __init__(
+        self,
+        preprocess: List[dict] = (),
+        filters: List[dict] = (),
+        channels: List[str] = ("antenna3",),
+    ) -> None:
+        for channel in channels:
+            if channel not in _FILTERABLE_CHANNELS:
+                raise ValueError("Cannot filter channel: {}".format(channel))
+        self.preprocess = list(preprocess)
+        self.filters = list(filters)
+        self.channels = list(channels)
+        # Fail early on invalid specs, rather than inside every worker
+        self.build()
+
+    @classmethod
+    def from_file(cls, path: str) -> "BatchConfig":
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the processing chain, so that a manifest entry is only
+        reused if its file was processed with the same configuration"""
+        config = json.dumps(self.__dict__, sort_keys=True)
+        return hashlib.sha1(config.encode()).hexdigest()
+
+    def build(self) -> Tuple[SignalProcessor, SpectrumFilter]:
+        return build_processor(self.preprocess), build_filter(self.filters)
+
+
+class Manifest:
+    """Append-only record of the files finished by previous runs.  Each line
+    stores the relative path, size and mtime of an input file along with the
+    fingerprint of the configuration used to process it, and the size and
+    mtime of the output written for it.  A file only counts as done while
+    its output still exists unchanged"""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._entries = {}
+        if os.path.exists(path):
+            self._entries = self._read(path)
+        self._file = None
+
+    def _read(self, path: str) -> dict:
+        entries = {}
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written line from an interrupted run
+                entries[entry["path"]] = entry
+        return entries
+
+    def _entry(
+        self,
+        relpath: str,
+        stat: os.stat_result,
+        config: str,
+        output_stat: os.stat_result,
+    ) -> dict:
+        return {
+            "path": relpath,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "config": config,
+            "output_size": output_stat.st_size,
+            "output_mtime": output_stat.st_mtime,
+        }
+
+    def is_done(
+        self, relpath: str, stat: os.stat_result, config: str, output: str
+    ) -> bool:
+        if not os.path.exists(output):
+            return False
+        entry = self._entry(relpath, stat, config, os.stat(output))
+        return self._entries.get(relpath) == entry
+
+    def add(
+        self, relpath: str, stat: os.stat_result, config: str, output: str
+    ) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a")
+        entry = self._entry(relpath, stat, config, os.stat(output))
+        self._entries[relpath] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_WORKER_STATE = {}
+
+
+def _init_worker(config: BatchConfig) -> None:
+    preprocess, spectrum_filter = config.build()
+    _WORKER_STATE["preprocess"] = preprocess
+    _WORKER_STATE["filter"] = spectrum_filter
+    _WORKER_STATE["channels"] = config.channels
+
+
+def _process_file(src: str, dst: str) -> int:
+    with open(src, "rb") as f:
+        cs = csfile.load(f, _WORKER_STATE["preprocess"])
+
+    spectrum_filter = _WORKER_STATE["filter"]
+    for channel in _WORKER_STATE["channels"]:
+        filtered = spectrum_filter(getattr(cs.spectrum, channel))
+        setattr(cs.spectrum, channel, filtered)
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + ".part"
+    try:
+        with open(tmp, "wb") as f:
+            csfile.dump(cs, f)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return os.path.getsize(src)
+
+
+def find_files(input_dir: str, pattern: str) -> List[str]:
+    """Relative paths of all files below input_dir matching the pattern"""
+    paths = glob.glob(os.path.join(input_dir, "**", pattern), recursive=True)
+    return sorted(os.path.relpath(path, input_dir) for path in paths)
+
+
+class _Progress:
+    def __init__(self, total: int, interval: float) -> None:
+        self._total = total
+        self._interval = interval
+        self._start = time.perf_counter()
+        self._last = self._start
+        self.num_files = 0
+        self.num_bytes = 0
+        self.num_failed = 0
+
+    def update(self, num_bytes: int) -> None:
+        self.num_files += 1
+        self.num_bytes += num_bytes
+        now = time.perf_counter()
+        if now - self._last >= self._interval:
+            self._last = now
+            print(self.summary(), flush=True)
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        return "{}/{} files, {} failed, {:.1f} files/s, {:.1f} MB/s".format(
+            self.num_files,
+            self._total,
+            self.num_failed,
+            self.num_files / elapsed,
+            self.num_bytes / (1024 * 1024) / elapsed,
+        )
+
+
+def run(
+    input_dir: str,
+    output_dir: str,
+    config: BatchConfig,
+    num_workers: int = None,
+    pattern: str = "*.cs",
+    manifest_path: str = None,
+    report_interval: float = 5.0,
+) -> int:
+    """Processes every file not yet recorded in the manifest, and returns
+    the number of files that failed"""
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(manifest_path)
+    fingerprint = config.fingerprint
+
+    relpaths = find_files(input_dir, pattern)
+    pending = []
+    for relpath in relpaths:
+        stat = os.stat(os.path.join(input_dir, relpath))
+        output = os.path.join(output_dir, relpath)
+        if not manifest.is_done(relpath, stat, fingerprint, output):
+            pending.append((relpath, stat))
+
+    num_skipped = len(relpaths) - len(pending)
+    print(
+        "{} files to process, {} already done".format(len(pending), num_skipped)
+    )
+    progress = _Progress(len(pending), report_interval)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(config,),
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _process_file,
+                    os.path.join(input_dir, relpath),
+                    os.path.join(output_dir, relpath),
+                ): (relpath, stat)
+                for relpath, stat in pending
+            }
+            for future in concurrent.futures.as_completed(futures):
+                relpath, stat = futures[future]
+                try:
+                    num_bytes = future.result()
+                except Exception as e:
+                    progress.num_failed += 1
+                    print("Failed {}: {}".format(relpath, e), file=sys.stderr)
+                    continue
+                output = os.path.join(output_dir, relpath)
+                manifest.add(relpath, stat, fingerprint, output)
+                progress.update(num_bytes)
+    finally:
+        manifest.close()
+    print(progress.summary())
+    return progress.num_failed
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("input_dir", help="directory searched for input files")
+    parser.add_argument("output_dir", help="directory processed files go to")
+    parser.add_argument("--config", help="JSON processing chain config")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--pattern", default="*.cs", help="file name pattern to process"
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="checkpoint manifest path, defaults to one in output_dir",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=5.0,
+        help="seconds between throughput reports",
+    )
+    args = parser.parse_args(argv)
+
+    config = BatchConfig()
+    if args.config:
+        config = BatchConfig.from_file(args.config)
+
+    num_failed = run(
+        args.input_dir,
+        args.output_dir,
+        config,
+        num_workers=args.workers,
+        pattern=args.pattern,
+        manifest_path=args.manifest,
+        report_interval=args.report_interval,
+    )
+    sys.exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
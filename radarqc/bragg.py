@@ -0,0 +1,189 @@
+"""First order Bragg region extraction and radial current velocities.
+
+Sea echo is dominated by two first order peaks, from ocean waves of half
+the radar wavelength travelling towards and away from the radar.  Without
+currents they sit at the Bragg frequencies +/- sqrt(g / (pi * wavelength)),
+and a radial current shifts both of them by 2 * velocity / wavelength.
+
+Doppler bins are assumed centered, with zero Doppler at bin
+num_doppler_cells // 2 and positive frequencies above it.  Velocities are
+positive towards the radar."""
+
+import functools
+
+from typing import Tuple
+
+import numpy as np
+
+from radarqc.header import CSFileHeader
+
+_SPEED_OF_LIGHT = 299792458.0
+_GRAVITY = 9.80665
+
+
+class SpectrumAxes:
+    """Physical axes of a spectrum, derived from a header.  Arrays are
+    read-only, since axes are cached and shared between callers"""
+
+    def __init__(
+        self,
+        start_freq_mhz: float,
+        rep_freq_hz: float,
+        num_doppler_cells: int,
+        num_range_cells: int,
+        first_range_cell: int,
+        range_cell_dist_km: float,
+    ) -> None:
+        self.wavelength = _SPEED_OF_LIGHT / (start_freq_mhz * 1e6)
+        self.bragg_frequency = np.sqrt(_GRAVITY / (np.pi * self.wavelength))
+        self.doppler_resolution = rep_freq_hz / num_doppler_cells
+        cells = np.arange(num_doppler_cells) - num_doppler_cells // 2
+        self.doppler = cells * self.doppler_resolution
+        signs = np.array([-1.0, 1.0])[:, np.newaxis]
+        self.velocity = (
+            (self.doppler - signs * self.bragg_frequency) * self.wavelength / 2
+        )
+        self.range_km = (
+            first_range_cell + np.arange(num_range_cells)
+        ) * range_cell_dist_km
+        for array in (self.doppler, self.velocity, self.range_km):
+            array.flags.writeable = False
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """(num_range, num_doppler) of spectra with these axes"""
+        return len(self.range_km), len(self.doppler)
+
+    def bragg_windows(self, max_velocity: float) -> np.ndarray:
+        """Boolean array with shape (2, num_doppler) selecting the bins of
+        the negative and positive first order peaks for currents up to
+        max_velocity m/s"""
+        in_window = np.abs(self.velocity) <= max_velocity
+        same_side = np.sign(self.doppler) == np.array([[-1], [1]])
+        return in_window & same_side
+
+
+@functools.lru_cache(maxsize=64)
+def _create_axes(*fields) -> SpectrumAxes:
+    return SpectrumAxes(*fields)
+
+
+def spectrum_axes(header: CSFileHeader) -> SpectrumAxes:
+    """Returns the axes for a header, computing them only once for every
+    distinct combination of the header fields they depend on.  As in the
+    file format, rep_freq_mhz holds the sweep repetition rate in Hz"""
+    return _create_axes(
+        header.start_freq_mhz,
+        header.rep_freq_mhz,
+        header.num_doppler_cells,
+        header.num_range_cells,
+        header.first_range_cell,
+        header.range_cell_dist_km,
+    )
+
+
+class BraggRegions:
+    """First order regions of a spectrum or a stack of spectra.
+
+    `mask` and `velocity` have the shape of the spectra, with velocities in
+    m/s inside the regions and nan elsewhere.  `bounds` has shape
+    (..., num_range, 2, 2) and holds the first and last bin of the negative
+    and positive regions of each range cell, or -1 if the peak was not
+    found.  `peak_velocity` has shape (..., num_range, 2) and holds the
+    velocity at each peak, or nan."""
+
+    def __init__(
+        self,
+        mask: np.ndarray,
+        velocity: np.ndarray,
+        bounds: np.ndarray,
+        peak_velocity: np.ndarray,
+    ) -> None:
+        self.mask = mask
+        self.velocity = velocity
+        self.bounds = bounds
+        self.peak_velocity = peak_velocity
+
+
+def _smooth(power: np.ndarray, width: int) -> np.ndarray:
+    if width <= 1:
+        return power
+    padded = np.pad(
+        power,
+        [(0, 0)] * (power.ndim - 1) + [(width // 2, (width - 1) // 2)],
+        mode="edge",
+    )
+    total = np.cumsum(padded, axis=-1, dtype=np.float64)
+    total = np.concatenate([np.zeros(power.shape[:-1] + (1,)), total], axis=-1)
+    return (total[..., width:] - total[..., :-width]) / width
+
+
+def first_order(
+    spectra: np.ndarray,
+    header: CSFileHeader,
+    max_velocity: float = 2.0,
+    null_db: float = 10.0,
+    snr_db: float = 10.0,
+    smoothing: int = 3,
+) -> BraggRegions:
+    """Locates the first order regions of every range cell of spectra with
+    shape (..., num_range, num_doppler), such as one antenna of a single
+    file or a stack of N files, all at once.
+
+    Spectra must be linear power, e.g. raw or Abs self-spectra.  Within the
+    window allowed by max_velocity, each side's peak is the maximum of the
+    spectrum smoothed over `smoothing` bins.  A region extends from its peak
+    to the nearest bins that are local minima or more than null_db below
+    the peak, and is discarded if the peak is less than snr_db above the
+    median of its range cell"""
+    axes = spectrum_axes(header)
+    power = np.asarray(spectra)
+    if power.shape[-2:] != axes.shape:
+        raise ValueError(
+            "Spectra with shape {} do not match header shape {}".format(
+                power.shape[-2:], axes.shape
+            )
+        )
+
+    smoothed = _smooth(power, smoothing)
+    db = 10 * np.log10(np.maximum(smoothed, np.finfo(np.float64).tiny))
+    noise = np.median(db, axis=-1)
+
+    windows = axes.bragg_windows(max_velocity)
+    db = db[..., np.newaxis, :]  # (..., num_range, 1, num_doppler)
+    windowed = np.where(windows, db, -np.inf)
+    peaks = windowed.argmax(axis=-1)
+    peak_db = np.take_along_axis(windowed, peaks[..., np.newaxis], axis=-1)
+    found = (peak_db[..., 0] - noise[..., np.newaxis]) >= snr_db
+
+    padded = np.pad(
+        db,
+        [(0, 0)] * (db.ndim - 1) + [(1, 1)],
+        constant_values=np.inf,
+    )
+    local_min = (db <= padded[..., :-2]) & (db <= padded[..., 2:])
+    null = ~windows | local_min | (db < peak_db - null_db)
+
+    bins = np.arange(axes.shape[1], dtype=np.int32)
+    peaks = peaks[..., np.newaxis].astype(np.int32)
+    lower = np.where(null & (bins < peaks), bins, -1).max(axis=-1) + 1
+    upper = np.where(null & (bins > peaks), bins, len(bins)).min(axis=-1) - 1
+    region = (
+        (bins >= lower[..., np.newaxis])
+        & (bins <= upper[..., np.newaxis])
+        & found[..., np.newaxis]
+    )
+
+    mask = region.any(axis=-2)
+    velocity = np.where(
+        region[..., 0, :],
+        axes.velocity[0],
+        np.where(region[..., 1, :], axes.velocity[1], np.nan),
+    ).astype(np.float32)
+    bounds = np.where(
+        found[..., np.newaxis], np.stack([lower, upper], axis=-1), -1
+    )
+    peak_velocity = np.where(
+        found, axes.velocity[[0, 1], peaks[..., 0]], np.nan
+    )
+    return BraggRegions(mask, velocity, bounds, peak_velocity)
@@ -0,0 +1,161 @@
+import collections
+import os
+import threading
+
+from typing import Tuple
+
+from radarqc import csfile
+from radarqc.csfile import CSFile
+from radarqc.processing import Identity, SignalProcessor
+
+_CHANNELS = (
+    "antenna1",
+    "antenna2",
+    "antenna3",
+    "cross12",
+    "cross13",
+    "cross23",
+    "quality",
+)
+
+
+def _channel_arrays(cs: CSFile):
+    for name in _CHANNELS:
+        yield getattr(cs.spectrum, name)
+
+
+def csfile_nbytes(cs: CSFile) -> int:
+    """Bytes held by the spectrum arrays of a CSFile"""
+    return cs.spectrum.nbytes
+
+
+class CacheStats:
+    """Snapshot of cache counters"""
+
+    def __init__(
+        self,
+        hits: int,
+        misses: int,
+        evictions: int,
+        num_entries: int,
+        nbytes: int,
+    ) -> None:
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.num_entries = num_entries
+        self.nbytes = nbytes
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            "CacheStats(hits={}, misses={}, evictions={}, num_entries={}, "
+            "nbytes={})".format(
+                self.hits,
+                self.misses,
+                self.evictions,
+                self.num_entries,
+                self.nbytes,
+            )
+        )
+
+
+class CSFileCache:
+    """Thread-safe LRU cache of decoded Cross-Spectrum files.
+
+    Entries are keyed by path, modification time, size and the fingerprint
+    of the preprocessing applied, so a file that changes on disk or is
+    loaded with a different preprocessor is decoded again.  The least
+    recently used entries are evicted once the spectrum arrays of all cached
+    files exceed `max_bytes`.
+
+    Cached files are shared between callers, so their arrays are made
+    read-only.  Copy an array before modifying it"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    def _key(self, path: str, fingerprint: str) -> Tuple:
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        return path, stat.st_mtime_ns, stat.st_size, fingerprint
+
+    def load(self, path: str, preprocess: SignalProcessor = None) -> CSFile:
+        """Returns the decoded file, loading it with `csfile.load` only if
+        it is not already cached.  Files loaded with a preprocessor that has
+        no fingerprint are never cached"""
+        if preprocess is None:
+            preprocess = Identity()
+
+        fingerprint = preprocess.fingerprint()
+        if fingerprint is None:
+            with self._lock:
+                self._misses += 1
+            with open(path, "rb") as f:
+                return csfile.load(f, preprocess)
+
+        key = self._key(path, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        # Decode outside the lock, so that other files can be served
+        with open(path, "rb") as f:
+            cs = csfile.load(f, preprocess)
+        # The channels are views of one buffer, so both the views and the
+        # buffer itself are made read-only
+        cs.spectrum.buffer.flags.writeable = False
+        for array in _channel_arrays(cs):
+            array.flags.writeable = False
+        self._insert(key, cs)
+        return cs
+
+    def _insert(self, key: Tuple, cs: CSFile) -> None:
+        nbytes = csfile_nbytes(cs)
+        if nbytes > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return  # decoded concurrently by another thread
+            self._entries[key] = (cs, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self._max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self._nbytes,
+            )
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,258 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.csfile import CSFile
+from radarqc.processing import SignalProcessor
+
+
+class CellStatistics:
+    """Streaming statistics for every (range, doppler) cell of a spectrum.
+
+    Keeps the count, mean and variance (using Welford's algorithm, extended
+    to batches), minimum and maximum of each cell, plus a fixed-bin
+    histogram used to approximate percentiles.  Memory does not depend on
+    the number of spectra seen, and partial statistics computed separately
+    can be combined with `merge`.  Non-finite values are ignored.
+
+    The histogram spans [low, high), linearly or, with `log`, in equal
+    ratios for data such as raw power that spans decades.  The range must
+    match the preprocessing of the data, e.g. [0, 1] after Normalize, so it
+    has no default.  Values outside it are counted apart, and percentiles
+    that fall among them are nan rather than a clipped estimate.  Set
+    num_bins to 0 to disable the histogram."""
+
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        low: float = None,
+        high: float = None,
+        num_bins: int = 64,
+        log: bool = False,
+    ) -> None:
+        if num_bins:
+            if low is None or high is None:
+                raise ValueError("The histogram needs explicit low and high")
+            if not high > low:
+                raise ValueError("high must be greater than low")
+            if log and not low > 0:
+                raise ValueError("A log histogram needs low > 0")
+        self._shape = tuple(shape)
+        self._low = low
+        self._high = high
+        self._num_bins = num_bins
+        self._log = log
+        self._count = np.zeros(shape, dtype=np.int64)
+        self._mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+        self._min = np.full(shape, np.inf)
+        self._max = np.full(shape, -np.inf)
+        # Bins 1 to num_bins cover [low, high), bin 0 counts values below
+        # low and the last bin values at or above high
+        num_slots = num_bins + 2 if num_bins else 0
+        self._histogram = np.zeros((num_slots,) + self._shape, dtype=np.int64)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self._shape
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of finite values seen in each cell"""
+        return self._count
+
+    @property
+    def mean(self) -> np.ndarray:
+        return np.where(self._count > 0, self._mean, np.nan)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Unbiased sample variance of each cell"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(
+                self._count > 1, self._m2 / (self._count - 1), np.nan
+            )
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    @property
+    def min(self) -> np.ndarray:
+        return np.where(self._count > 0, self._min, np.nan)
+
+    @property
+    def max(self) -> np.ndarray:
+        return np.where(self._count > 0, self._max, np.nan)
+
+    @property
+    def bin_edges(self) -> np.ndarray:
+        if self._log:
+            return np.geomspace(self._low, self._high, self._num_bins + 1)
+        return np.linspace(self._low, self._high, self._num_bins + 1)
+
+    def _scale(self, values: np.ndarray) -> np.ndarray:
+        """Maps values to fractional bin positions"""
+        if self._log:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.log(values / self._low)
+            return values / np.log(self._high / self._low) * self._num_bins
+        return (values - self._low) / (self._high - self._low) * self._num_bins
+
+    def update(self, spectra: np.ndarray) -> None:
+        """Adds one spectrum with shape (num_range, num_doppler), or a batch
+        of spectra with shape (N, num_range, num_doppler)"""
+        spectra = np.asarray(spectra, dtype=np.float64)
+        if spectra.shape == self._shape:
+            spectra = spectra[np.newaxis]
+        if spectra.shape[1:] != self._shape:
+            raise ValueError(
+                "Spectra with shape {} do not match {}".format(
+                    spectra.shape[1:], self._shape
+                )
+            )
+
+        finite = np.isfinite(spectra)
+        values = np.where(finite, spectra, 0.0)
+        count = finite.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, values.sum(axis=0) / count, 0.0)
+        m2 = (np.where(finite, spectra - mean, 0.0) ** 2).sum(axis=0)
+        self._combine(count, mean, m2)
+
+        self._min = np.minimum(
+            self._min, np.where(finite, spectra, np.inf).min(axis=0)
+        )
+        self._max = np.maximum(
+            self._max, np.where(finite, spectra, -np.inf).max(axis=0)
+        )
+        if self._num_bins:
+            self._update_histogram(spectra, finite)
+
+    def _combine(
+        self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray
+    ) -> None:
+        total = self._count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self._mean
+            weight = np.where(total > 0, count / total, 0.0)
+            self._mean = self._mean + delta * weight
+            self._m2 = self._m2 + m2 + delta**2 * self._count * weight
+        self._count = total
+
+    def _update_histogram(
+        self, spectra: np.ndarray, finite: np.ndarray
+    ) -> None:
+        # Values below low, including non-positive values on a log scale,
+        # land in bin 0
+        position = np.nan_to_num(self._scale(spectra[finite]), nan=-1.0)
+        bins = np.floor(position).clip(-1, self._num_bins).astype(np.int64) + 1
+        num_cells = int(np.prod(self._shape))
+        cells = np.broadcast_to(
+            np.arange(num_cells).reshape(self._shape), spectra.shape
+        )[finite]
+        counts = np.bincount(
+            bins * num_cells + cells, minlength=len(self._histogram) * num_cells
+        )
+        self._histogram += counts.reshape(self._histogram.shape)
+
+    def merge(self, other: "CellStatistics") -> "CellStatistics":
+        """Adds the statistics of another aggregate with the same shape and
+        histogram bins into this one, and returns this aggregate"""
+        if (
+            other._shape,
+            other._low,
+            other._high,
+            other._num_bins,
+            other._log,
+        ) != (self._shape, self._low, self._high, self._num_bins, self._log):
+            raise ValueError("Cannot merge statistics with different layouts")
+        self._combine(other._count, other._mean, other._m2)
+        self._min = np.minimum(self._min, other._min)
+        self._max = np.maximum(self._max, other._max)
+        self._histogram += other._histogram
+        return self
+
+    def percentile(self, q: float) -> np.ndarray:
+        """Approximate q-th percentile of each cell, interpolated linearly
+        within histogram bins, or nan where it lies outside [low, high)"""
+        if not self._num_bins:
+            raise ValueError("Percentiles require a histogram")
+        cumulative = np.cumsum(self._histogram, axis=0)
+        target = q / 100 * self._count
+        # A small positive floor makes q=0 select the first non-empty bin
+        threshold = np.maximum(target, 1e-9)
+        index = (cumulative < threshold[np.newaxis]).sum(axis=0)
+        index = index.clip(0, self._num_bins + 1)
+        below = np.where(
+            index > 0,
+            np.take_along_axis(
+                cumulative, (index - 1).clip(0)[np.newaxis], axis=0
+            )[0],
+            0,
+        )
+        in_bin = np.take_along_axis(self._histogram, index[np.newaxis], axis=0)[
+            0
+        ]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.where(in_bin > 0, (target - below) / in_bin, 0.0)
+        edges = self.bin_edges
+        inside = (index >= 1) & (index <= self._num_bins)
+        bin_index = (index - 1).clip(0, self._num_bins - 1)
+        # Bins are narrowed to the observed range of each cell, so that a
+        # cell whose values all share one bin still gets a usable estimate
+        low = np.maximum(edges[bin_index], self._min)
+        high = np.minimum(edges[bin_index + 1], self._max)
+        values = low + fraction.clip(0, 1) * (high - low)
+        values = values.clip(self._min, self._max)
+        return np.where((self._count > 0) & inside, values, np.nan)
+
+
+class Climatology:
+    """Streaming per-channel statistics over many Cross-Spectrum files.
+    Complex cross-spectra are aggregated by magnitude.  The histogram
+    range applies to every channel, see CellStatistics"""
+
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        channels: Iterable[str] = ("antenna1", "antenna2", "antenna3"),
+        low: float = None,
+        high: float = None,
+        num_bins: int = 64,
+        log: bool = False,
+    ) -> None:
+        self._channels = {
+            channel: CellStatistics(shape, low, high, num_bins, log)
+            for channel in channels
+        }
+
+    @property
+    def channels(self) -> Iterable[str]:
+        return list(self._channels)
+
+    def __getitem__(self, channel: str) -> CellStatistics:
+        return self._channels[channel]
+
+    def update(self, cs: CSFile) -> None:
+        for channel, statistics in self._channels.items():
+            spectrum = getattr(cs.spectrum, channel)
+            if np.iscomplexobj(spectrum):
+                spectrum = np.abs(spectrum)
+            statistics.update(spectrum)
+
+    def update_paths(
+        self, paths: Iterable[str], preprocess: SignalProcessor = None
+    ) -> None:
+        """Loads and adds files one at a time"""
+        for path in paths:
+            with open(path, "rb") as f:
+                self.update(csfile.load(f, preprocess))
+
+    def merge(self, other: "Climatology") -> "Climatology":
+        if set(other.channels) != set(self.channels):
+            raise ValueError("Cannot merge climatologies of other channels")
+        for channel, statistics in self._channels.items():
+            statistics.merge(other[channel])
+        return self
@@ -16,6 +16,11 @@ class CSFile:
         self._header = header
         self._spectrum = spectrum
 
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        """Spectrum data is sent out-of-band with pickle protocol 5, see
+        `Spectrum.__reduce_ex__`"""
+        return (self.__class__, (self._header, self._spectrum))
+
     @property
     def header(self) -> CSFileHeader:
         """File header, contains all file metadata"""
@@ -65,6 +70,12 @@ def load(f: BinaryIO, preprocess: SignalProcessor = None) -> CSFile:
     return CSFile(header, spectrum)
 
 
+def load_header(f: BinaryIO) -> CSFileHeader:
+    """Reads the header of a Cross-Spectrum file without decoding the
+    spectrum data that follows it"""
+    return CSFileReader().load_header(f)
+
+
 def dump(cs: CSFile, f: BinaryIO) -> None:
     header, spectrum = cs.header, cs.spectrum
     CSFileWriter().dump(header, spectrum, f)
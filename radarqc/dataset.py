@@ -1,13 +1,114 @@
-from typing import Iterable
+import datetime
+
+from typing import Iterable, Iterator, Tuple, Union
 
 import numpy as np
 
 from radarqc import csfile
+from radarqc.archive import Archive, ArchiveChannel
 from radarqc.csfile import CSFile, CSFileHeader
 from radarqc.processing import SignalProcessor
 
 
-class DataSet:
+def window_view(spectra: np.ndarray, length: int) -> np.ndarray:
+    """Read-only view of all windows of `length` consecutive spectra, with
+    shape (N - length + 1, length, num_range, num_doppler).  No data is
+    copied, windows share memory with the input"""
+    num_windows = len(spectra) - length + 1
+    if length < 1 or num_windows < 1:
+        return np.empty((0, length) + spectra.shape[1:], dtype=spectra.dtype)
+    return np.lib.stride_tricks.as_strided(
+        spectra,
+        shape=(num_windows, length) + spectra.shape[1:],
+        strides=(spectra.strides[0],) + spectra.strides,
+        writeable=False,
+    )
+
+
+class _TimeSeries:
+    """Time windows over the `spectra` and `headers` of a subclass"""
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Timestamp of each spectrum as datetime64"""
+        times = [header.timestamp for header in self.headers]
+        return np.array(times, dtype="datetime64[us]")
+
+    def _time_order(self) -> np.ndarray:
+        return np.argsort(self.timestamps, kind="stable")
+
+    def _time_ordered_spectra(self, order: np.ndarray) -> np.ndarray:
+        """Spectra sorted by timestamp.  Only copies if the spectra were not
+        loaded in time order"""
+        if np.array_equal(order, np.arange(len(order))):
+            return self.spectra
+        return np.asarray(self.spectra)[order]
+
+    def window_starts(
+        self, length: int, interval: datetime.timedelta = None
+    ) -> np.ndarray:
+        """Indices, in time order, of every window of `length` spectra that
+        does not span a gap.  A gap is a step between consecutive timestamps
+        longer than 1.5 times `interval`, which defaults to the median step"""
+        times = np.sort(self.timestamps)
+        num_windows = len(times) - length + 1
+        if length < 1 or num_windows < 1:
+            return np.empty(0, dtype=np.int64)
+
+        steps = np.diff(times)
+        if interval is None:
+            interval = np.median(steps) if len(steps) else 0
+        tolerance = 1.5 * np.timedelta64(interval, "us").astype(np.float64)
+        gaps = steps.astype("timedelta64[us]").astype(np.float64) > tolerance
+        # Number of gaps before each position, a window starting at i is
+        # valid if there are no gaps between positions i and i + length - 1
+        num_gaps = np.concatenate([[0], np.cumsum(gaps)])
+        starts = np.arange(num_windows)
+        valid = num_gaps[starts + length - 1] == num_gaps[starts]
+        return starts[valid]
+
+    def windows(
+        self, length: int, interval: datetime.timedelta = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns a read-only view of every window of `length` consecutive
+        spectra in time order, with shape (N - length + 1, length,
+        num_range, num_doppler), and the indices of the windows that do not
+        span a gap.  Indexing the view with those indices copies the
+        windows, use `iter_windows` to materialize them in batches.
+
+        The view needs all spectra in memory, so this raises for lazy
+        spectra such as those of an ArchiveDataSet, which should use
+        `iter_windows` instead"""
+        if not isinstance(self.spectra, np.ndarray):
+            raise TypeError(
+                "Windows of lazy spectra would read all of them, "
+                "use iter_windows instead"
+            )
+        order = self._time_order()
+        spectra = self._time_ordered_spectra(order)
+        view = window_view(np.asarray(spectra), length)
+        return view, self.window_starts(length, interval)
+
+    def iter_windows(
+        self,
+        length: int,
+        batch_size: int,
+        interval: datetime.timedelta = None,
+    ) -> Iterator[np.ndarray]:
+        """Yields batches of windows that do not span a gap, with shape
+        (batch_size, length, num_range, num_doppler).  Only one batch is
+        materialized at a time, and spectra backed by an archive are only
+        read for the windows in the current batch"""
+        starts = self.window_starts(length, interval)
+        spectra = self._time_ordered_spectra(self._time_order())
+        for i in range(0, len(starts), batch_size):
+            batch = starts[i : i + batch_size]
+            first, last = int(batch[0]), int(batch[-1]) + length
+            block = np.asarray(spectra[first:last])
+            yield window_view(block, length)[batch - first]
+
+
+class DataSet(_TimeSeries):
     """Supports aggregation of all Cross-Spectrum files in a given directory
     into a batch of images.
 
@@ -39,3 +140,35 @@ class DataSet:
     def _load_spectrum(self, path: str, preprocess: SignalProcessor) -> CSFile:
         with open(path, "rb") as f:
             return csfile.load(f, preprocess)
+
+
+class ArchiveDataSet(_TimeSeries):
+    """Spectra and headers of one channel of an archive written with
+    `radarqc.archive.export`.  Unlike DataSet, spectra are read lazily, and
+    slicing them only decompresses the chunks that are touched"""
+
+    def __init__(
+        self, archive: Union[Archive, str], channel: str = "antenna3"
+    ) -> None:
+        if isinstance(archive, str):
+            archive = Archive(archive)
+        self._archive = archive
+        self._spectra = archive.channel(channel)
+
+    @property
+    def spectra(self) -> ArchiveChannel:
+        """Lazy array with shape (N, num_range, num_doppler).  Indexing it
+        with integers or slices returns numpy arrays, and `np.asarray` reads
+        all of it"""
+        return self._spectra
+
+    @property
+    def headers(self) -> Iterable[CSFileHeader]:
+        """Header of each spectrum, built on access"""
+        return self._archive.headers
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Timestamp of each spectrum, read from the archive's timestamp
+        column without building headers"""
+        return self._archive.times.astype("datetime64[us]")
@@ -0,0 +1,410 @@
+"""Bulk comparison of Cross-Spectrum files for regression checks.
+
+Every file below the reference directory is paired with the file at the
+same relative path below the candidate directory, and the pairs are
+compared in parallel worker processes.  Headers are compared field by
+field.  Spectra are memory mapped rather than decoded and read a block of
+range cells at a time, and each channel is compared against the reference
+with the same test as numpy.allclose,
+|candidate - reference| <= atol + rtol * |reference|, reporting the number
+of mismatched cells and the maximum absolute difference of every range
+cell.  Cross-spectra are compared by their real and imaginary parts.
+
+Exits with status 1 if any pair differs or is missing."""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.batch import find_files
+from radarqc.header import CSFileHeader
+
+# Channels in the order they are stored in each range cell row, with the
+# number of float32 values per doppler cell
+_CHANNEL_LAYOUT = (
+    ("antenna1", 1),
+    ("antenna2", 1),
+    ("antenna3", 1),
+    ("cross12", 2),
+    ("cross13", 2),
+    ("cross23", 2),
+    ("quality", 1),
+)
+
+
+def _channels(cskind: int) -> Tuple[Tuple[str, int], ...]:
+    return _CHANNEL_LAYOUT if cskind >= 2 else _CHANNEL_LAYOUT[:-1]
+
+
+def map_file(path: str) -> Tuple[CSFileHeader, np.ndarray]:
+    """Parses the header of a file and memory maps its spectrum data as
+    big-endian float32 rows, one per range cell, without decoding it"""
+    with open(path, "rb") as f:
+        header = csfile.load_header(f)
+        offset = f.tell()
+    num_planes = sum(size for _, size in _channels(header.cskind))
+    shape = (header.num_range_cells, num_planes * header.num_doppler_cells)
+    num_bytes = os.path.getsize(path) - offset
+    if num_bytes < 4 * shape[0] * shape[1]:
+        raise ValueError(
+            "Truncated spectrum data, {} bytes instead of {}".format(
+                num_bytes, 4 * shape[0] * shape[1]
+            )
+        )
+    rows = np.memmap(path, dtype=">f4", mode="r", offset=offset, shape=shape)
+    return header, rows
+
+
+class ChannelDiff:
+    """Differences of one channel, per range cell"""
+
+    def __init__(self, max_abs_diff: np.ndarray, num_mismatched: np.ndarray):
+        self.max_abs_diff = max_abs_diff
+        self.num_mismatched = num_mismatched
+
+    @property
+    def matches(self) -> bool:
+        return not self.num_mismatched.any()
+
+
+class FileDiff:
+    """Result of comparing one pair of files.  `header` maps each differing
+    header field to its (reference, candidate) values, and `error` is set
+    if the pair could not be compared"""
+
+    def __init__(
+        self,
+        relpath: str,
+        header: Dict[str, Tuple] = None,
+        channels: Dict[str, ChannelDiff] = None,
+        error: str = None,
+    ) -> None:
+        self.relpath = relpath
+        self.header = header or {}
+        self.channels = channels or {}
+        self.error = error
+
+    @property
+    def matches(self) -> bool:
+        return (
+            self.error is None
+            and not self.header
+            and all(diff.matches for diff in self.channels.values())
+        )
+
+    def describe(self) -> str:
+        """One line summary of what differs"""
+        if self.error is not None:
+            return "{}: {}".format(self.relpath, self.error)
+        parts = []
+        if self.header:
+            parts.append("header fields " + ", ".join(sorted(self.header)))
+        for name, diff in self.channels.items():
+            if not diff.matches:
+                parts.append(
+                    "{} {} cells in {} range cells, max diff {:.3g}".format(
+                        name,
+                        int(diff.num_mismatched.sum()),
+                        int(np.count_nonzero(diff.num_mismatched)),
+                        float(diff.max_abs_diff.max()),
+                    )
+                )
+        return "{}: {}".format(self.relpath, "; ".join(parts) or "match")
+
+
+def compare_headers(
+    reference: CSFileHeader,
+    candidate: CSFileHeader,
+    ignore_fields: Iterable[str] = (),
+) -> Dict[str, Tuple]:
+    """Maps each differing header field to its (reference, candidate)
+    values"""
+    ignore_fields = set(ignore_fields)
+    expected, actual = reference.as_dict(), candidate.as_dict()
+    return {
+        name: (expected[name], actual[name])
+        for name in expected
+        if name not in ignore_fields and expected[name] != actual[name]
+    }
+
+
+def compare_spectra(
+    reference: np.ndarray,
+    candidate: np.ndarray,
+    cskind: int,
+    num_doppler_cells: int,
+    rtol: float = 1e-5,
+    atol: float = 1e-8,
+    block_size: int = 64,
+) -> Dict[str, ChannelDiff]:
+    """Compares the float32 rows of two mapped files with the same layout,
+    all channels at once, reading block_size range cells at a time.  Cells
+    that are nan in both files match, like equal infinities do"""
+    num_range = len(reference)
+    # (num_range, num_planes, num_doppler), where each plane is one float
+    # per doppler cell
+    num_planes = reference.shape[1] // num_doppler_cells
+    max_abs_diff = np.zeros((num_range, num_planes))
+    num_mismatched = np.zeros((num_range, num_planes), dtype=np.int64)
+    for start in range(0, num_range, block_size):
+        stop = start + block_size
+        expected = np.asarray(reference[start:stop], dtype=np.float64)
+        actual = np.asarray(candidate[start:stop], dtype=np.float64)
+
+        mismatched = ~np.isclose(actual, expected, rtol, atol, equal_nan=True)
+        with np.errstate(invalid="ignore"):
+            diff = np.abs(actual - expected)
+        both_nan = np.isnan(expected) & np.isnan(actual)
+        diff[(actual == expected) | both_nan] = 0
+        diff[np.isnan(diff)] = np.inf
+
+        planes = (len(expected), num_planes, num_doppler_cells)
+        max_abs_diff[start:stop] = diff.reshape(planes).max(axis=-1, initial=0)
+        num_mismatched[start:stop] = mismatched.reshape(planes).sum(axis=-1)
+
+    channels = {}
+    start = 0
+    for name, size in _channels(cskind):
+        channels[name] = ChannelDiff(
+            max_abs_diff[:, start : start + size].max(axis=1),
+            num_mismatched[:, start : start + size].sum(axis=1),
+        )
+        start += size
+    return channels
+
+
+def diff_files(
+    reference_path: str,
+    candidate_path: str,
+    relpath: str = None,
+    rtol: float = 1e-5,
+    atol: float = 1e-8,
+    ignore_fields: Iterable[str] = (),
+) -> FileDiff:
+    """Compares one pair of files"""
+    if relpath is None:
+        relpath = candidate_path
+    if not os.path.exists(candidate_path):
+        return FileDiff(relpath, error="missing from candidate")
+
+    reference_header, reference = map_file(reference_path)
+    candidate_header, candidate = map_file(candidate_path)
+    header = compare_headers(reference_header, candidate_header, ignore_fields)
+    if reference.shape != candidate.shape or (
+        reference_header.cskind != candidate_header.cskind
+    ):
+        return FileDiff(
+            relpath,
+            header,
+            error="spectrum layout {} (cskind {}) differs from {} "
+            "(cskind {})".format(
+                candidate.shape,
+                candidate_header.cskind,
+                reference.shape,
+                reference_header.cskind,
+            ),
+        )
+
+    channels = compare_spectra(
+        reference,
+        candidate,
+        reference_header.cskind,
+        reference_header.num_doppler_cells,
+        rtol,
+        atol,
+    )
+    return FileDiff(relpath, header, channels)
+
+
+_WORKER_STATE = {}
+
+
+def _init_worker(rtol: float, atol: float, ignore_fields: Tuple) -> None:
+    _WORKER_STATE["rtol"] = rtol
+    _WORKER_STATE["atol"] = atol
+    _WORKER_STATE["ignore_fields"] = ignore_fields
+
+
+def _diff_pair(reference_path: str, candidate_path: str, relpath: str):
+    try:
+        return diff_files(
+            reference_path,
+            candidate_path,
+            relpath,
+            _WORKER_STATE["rtol"],
+            _WORKER_STATE["atol"],
+            _WORKER_STATE["ignore_fields"],
+        )
+    except Exception as e:
+        return FileDiff(relpath, error="{}: {}".format(type(e).__name__, e))
+
+
+class DiffReport:
+    """Results of a bulk comparison"""
+
+    def __init__(
+        self,
+        diffs: List[FileDiff],
+        extra: List[str],
+        num_skipped: int = 0,
+    ) -> None:
+        self.diffs = sorted(diffs, key=lambda diff: diff.relpath)
+        self.extra = extra
+        self.num_skipped = num_skipped
+
+    @property
+    def mismatches(self) -> List[FileDiff]:
+        return [diff for diff in self.diffs if not diff.matches]
+
+    @property
+    def matches(self) -> bool:
+        return not self.mismatches and not self.extra and not self.num_skipped
+
+    def max_abs_diff(self) -> Dict[str, float]:
+        """Largest difference of each channel over all compared files"""
+        worst = {}
+        for diff in self.diffs:
+            for name, channel in diff.channels.items():
+                value = float(channel.max_abs_diff.max(initial=0))
+                worst[name] = max(worst.get(name, 0.0), value)
+        return worst
+
+    def summary(self, max_listed: int = 20) -> str:
+        mismatches = self.mismatches
+        lines = [
+            "{} files compared, {} match, {} differ, {} only in candidate, "
+            "{} skipped".format(
+                len(self.diffs),
+                len(self.diffs) - len(mismatches),
+                len(mismatches),
+                len(self.extra),
+                self.num_skipped,
+            )
+        ]
+        worst = self.max_abs_diff()
+        if worst:
+            lines.append(
+                "max abs diff: "
+                + ", ".join(
+                    "{} {:.3g}".format(name, value)
+                    for name, value in worst.items()
+                )
+            )
+        for diff in mismatches[:max_listed]:
+            lines.append("  " + diff.describe())
+        for relpath in self.extra[: max(max_listed - len(mismatches), 0)]:
+            lines.append("  {}: missing from reference".format(relpath))
+        num_listed = min(len(mismatches) + len(self.extra), max_listed)
+        num_hidden = len(mismatches) + len(self.extra) - num_listed
+        if num_hidden > 0:
+            lines.append("  ... and {} more".format(num_hidden))
+        return "\n".join(lines)
+
+
+def run(
+    reference_dir: str,
+    candidate_dir: str,
+    rtol: float = 1e-5,
+    atol: float = 1e-8,
+    ignore_fields: Iterable[str] = (),
+    num_workers: int = None,
+    pattern: str = "*.cs",
+    fail_fast: bool = False,
+) -> DiffReport:
+    """Compares every file below reference_dir with its counterpart below
+    candidate_dir.  With fail_fast, pending comparisons are cancelled as
+    soon as one pair differs, and counted as skipped"""
+    relpaths = find_files(reference_dir, pattern)
+    extra = sorted(set(find_files(candidate_dir, pattern)) - set(relpaths))
+
+    diffs = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_worker,
+        initargs=(rtol, atol, tuple(ignore_fields)),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _diff_pair,
+                os.path.join(reference_dir, relpath),
+                os.path.join(candidate_dir, relpath),
+                relpath,
+            )
+            for relpath in relpaths
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            diff = future.result()
+            diffs.append(diff)
+            if fail_fast and not diff.matches:
+                for pending in futures:
+                    pending.cancel()
+                break
+    return DiffReport(diffs, extra, len(relpaths) - len(diffs))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("reference_dir", help="directory of reference files")
+    parser.add_argument("candidate_dir", help="directory of files to check")
+    parser.add_argument(
+        "--rtol", type=float, default=1e-5, help="relative tolerance"
+    )
+    parser.add_argument(
+        "--atol", type=float, default=1e-8, help="absolute tolerance"
+    )
+    parser.add_argument(
+        "--ignore-field",
+        action="append",
+        default=[],
+        help="header field to leave out of the comparison, may be repeated",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--pattern", default="*.cs", help="file name pattern to compare"
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop at the first pair that differs",
+    )
+    parser.add_argument(
+        "--max-listed",
+        type=int,
+        default=20,
+        help="number of differing files listed in the summary",
+    )
+    args = parser.parse_args(argv)
+    for directory in (args.reference_dir, args.candidate_dir):
+        if not os.path.isdir(directory):
+            parser.error("{} is not a directory".format(directory))
+
+    report = run(
+        args.reference_dir,
+        args.candidate_dir,
+        rtol=args.rtol,
+        atol=args.atol,
+        ignore_fields=args.ignore_field,
+        num_workers=args.workers,
+        pattern=args.pattern,
+        fail_fast=args.fail_fast,
+    )
+    print(report.summary(args.max_listed))
+    sys.exit(0 if report.matches else 1)
+
+
+if __name__ == "__main__":
+    main()
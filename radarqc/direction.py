@@ -0,0 +1,188 @@
+"""Direction finding from SeaSonde cross-spectra using MUSIC.
+
+For every (range, doppler) cell the self and cross spectra of the three
+antennas form a 3x3 Hermitian covariance matrix.  MUSIC splits its
+eigenvectors into signal and noise subspaces, and the bearings of the
+signals are those whose antenna response is most orthogonal to the noise
+subspace.  All cells are processed with batched numpy operations.
+
+Antenna spectra are used as given, so preprocessing that changes their
+scale (such as GainCalculator or Normalize) should not be applied before
+direction finding."""
+
+from typing import Tuple
+
+import numpy as np
+
+from radarqc.spectrum import Spectrum
+
+
+class AntennaPattern:
+    """Complex response of the three antennas (loop 1, loop 2, monopole)
+    to a signal arriving from each bearing of a grid"""
+
+    def __init__(self, bearings: np.ndarray, response: np.ndarray) -> None:
+        bearings = np.asarray(bearings, dtype=np.float64)
+        response = np.asarray(response, dtype=np.complex128)
+        if response.shape != (3,) + bearings.shape:
+            raise ValueError("Response must have shape (3, num_bearings)")
+        self._bearings = bearings
+        self._response = response / np.linalg.norm(response, axis=0)
+        step = np.diff(bearings)
+        self._circular = (
+            len(bearings) > 2
+            and np.allclose(step, step[0])
+            and np.isclose(bearings[-1] - bearings[0] + step[0], 360)
+        )
+
+    @classmethod
+    def ideal(cls, bearings: np.ndarray = None) -> "AntennaPattern":
+        """Ideal SeaSonde pattern: cos and sin responses for the crossed
+        loops and a uniform response for the monopole.  Bearings are in
+        degrees, counter-clockwise from the loop 1 axis, on a 1 degree grid
+        by default"""
+        if bearings is None:
+            bearings = np.arange(0, 360, 1.0)
+        theta = np.deg2rad(bearings)
+        response = np.stack([np.cos(theta), np.sin(theta), np.ones_like(theta)])
+        return cls(bearings, response)
+
+    @property
+    def bearings(self) -> np.ndarray:
+        """Bearing grid in degrees"""
+        return self._bearings
+
+    @property
+    def circular(self) -> bool:
+        """Whether the grid is uniform and covers the full circle, so that
+        its first and last bearings are neighbours"""
+        return self._circular
+
+    @property
+    def response(self) -> np.ndarray:
+        """Unit norm response with shape (3, num_bearings)"""
+        return self._response
+
+
+def covariance_matrices(
+    antenna1: np.ndarray,
+    antenna2: np.ndarray,
+    antenna3: np.ndarray,
+    cross12: np.ndarray,
+    cross13: np.ndarray,
+    cross23: np.ndarray,
+) -> np.ndarray:
+    """Assembles the covariance matrix of every cell, from channels of any
+    matching shape, e.g. (num_range, num_doppler) or a stack of those.
+    Returns a complex array with shape (..., 3, 3)"""
+    shape = np.shape(antenna1)
+    cov = np.empty(shape + (3, 3), dtype=np.complex128)
+    cov[..., 0, 0] = antenna1
+    cov[..., 1, 1] = antenna2
+    cov[..., 2, 2] = antenna3
+    cov[..., 0, 1] = cross12
+    cov[..., 0, 2] = cross13
+    cov[..., 1, 2] = cross23
+    cov[..., 1, 0] = np.conj(cross12)
+    cov[..., 2, 0] = np.conj(cross13)
+    cov[..., 2, 1] = np.conj(cross23)
+    return cov
+
+
+def spectrum_covariance(spectrum: Spectrum) -> np.ndarray:
+    """Covariance matrices of every cell of a Spectrum, with shape
+    (num_range, num_doppler, 3, 3)"""
+    return covariance_matrices(
+        spectrum.antenna1,
+        spectrum.antenna2,
+        spectrum.antenna3,
+        spectrum.cross12,
+        spectrum.cross13,
+        spectrum.cross23,
+    )
+
+
+def _pseudo_spectrum(
+    cov: np.ndarray, pattern: AntennaPattern, num_signals: int
+):
+    _, vectors = np.linalg.eigh(cov)
+    # eigh sorts eigenvalues in ascending order, so the signal subspace is
+    # spanned by the last num_signals eigenvectors.  The response is unit
+    # norm, so its distance to the noise subspace is one minus its energy
+    # in the signal subspace, which needs fewer products to evaluate
+    signal = vectors[..., 3 - num_signals :]
+    # One (cells * num_signals, 3) @ (3, num_bearings) product runs as a
+    # single BLAS call, unlike a stack of small matrix products
+    rows = signal.conj().swapaxes(-1, -2).reshape((-1, 3))
+    projection = rows @ pattern.response
+    energy = projection.real**2 + projection.imag**2
+    energy = energy.reshape((len(cov), num_signals, -1)).sum(axis=1)
+    distance = np.maximum(1 - energy, np.finfo(np.float64).eps)
+    return 1 / distance
+
+
+def _strongest_peaks(
+    power: np.ndarray, num_signals: int, circular: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and values of the num_signals largest local maxima along the
+    last axis, -1 and nan if there are fewer maxima"""
+    if circular:
+        padded = np.pad(power, ((0, 0), (1, 1)), mode="wrap")
+    else:
+        padded = np.pad(power, ((0, 0), (1, 1)), constant_values=-np.inf)
+    center = padded[:, 1:-1]
+    is_peak = (center >= padded[:, :-2]) & (center > padded[:, 2:])
+    peaks = np.where(is_peak, power, -np.inf)
+    if num_signals == 1:
+        indices = peaks.argmax(axis=1)[:, np.newaxis]
+    else:
+        indices = np.argpartition(-peaks, num_signals - 1, axis=1)
+        indices = indices[:, :num_signals]
+        order = np.argsort(-np.take_along_axis(peaks, indices, axis=1), axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+    values = np.take_along_axis(peaks, indices, axis=1)
+    found = np.isfinite(values)
+    return np.where(found, indices, -1), np.where(found, values, np.nan)
+
+
+def music(
+    cov: np.ndarray,
+    pattern: AntennaPattern,
+    num_signals: int = 1,
+    batch_size: int = 4096,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Estimates bearings for every covariance matrix in an array with
+    shape (..., 3, 3).  Returns bearings in degrees and MUSIC pseudo
+    spectrum peak values, both with shape (..., num_signals), ordered from
+    the strongest peak.  Bearings are nan where no peak was found.
+
+    Cells are processed in batches of batch_size, which bounds the memory
+    used by the (cells, bearings) intermediate arrays"""
+    if num_signals not in (1, 2):
+        raise ValueError("MUSIC with 3 antennas resolves 1 or 2 signals")
+
+    shape = cov.shape[:-2]
+    flat = cov.reshape((-1, 3, 3))
+    indices = np.empty((len(flat), num_signals), dtype=np.int64)
+    peaks = np.empty((len(flat), num_signals), dtype=np.float64)
+    for start in range(0, len(flat), batch_size):
+        stop = start + batch_size
+        power = _pseudo_spectrum(flat[start:stop], pattern, num_signals)
+        indices[start:stop], peaks[start:stop] = _strongest_peaks(
+            power, num_signals, pattern.circular
+        )
+
+    bearings = np.where(indices >= 0, pattern.bearings[indices], np.nan)
+    return (
+        bearings.reshape(shape + (num_signals,)),
+        peaks.reshape(shape + (num_signals,)),
+    )
+
+
+def estimate_bearings(
+    spectrum: Spectrum, pattern: AntennaPattern, num_signals: int = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Runs MUSIC on every (range, doppler) cell of a Spectrum, returning
+    bearings and peak values with shape (num_range, num_doppler,
+    num_signals)"""
+    return music(spectrum_covariance(spectrum), pattern, num_signals)
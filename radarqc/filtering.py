@@ -1,42 +1,174 @@
 import abc
 import numpy as np
-from scipy import signal as sig
 
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
+from typing import Tuple, Union
+
+from radarqc import profiling
 
 
 class SpectrumFilter(abc.ABC):
     def __call__(self, spectrum: np.ndarray) -> np.ndarray:
-        return self._filter(spectrum)
+        with profiling.stage("filtering", self) as stage:
+            stage.nbytes = spectrum.nbytes
+            return self._filter(spectrum)
 
     @abc.abstractmethod
     def _filter(self, spectrum: np.ndarray) -> np.ndarray:
         """Subclasses override to provide custom filtering"""
 
 
+class CompositeFilter(SpectrumFilter):
+    """Represents a chain of filters applied one after another, in the
+    order they are given"""
+
+    def __init__(self, *filters) -> None:
+        self._filters = filters
+
+    def _filter(self, spectrum: np.ndarray) -> np.ndarray:
+        for spectrum_filter in self._filters:
+            spectrum = spectrum_filter(spectrum)
+        return spectrum
+
+
+class _StandardScaler:
+    """NumPy implementation of the subset of
+    `sklearn.preprocessing.StandardScaler` used by the PCA filters"""
+
+    def __init__(self) -> None:
+        self._mean = None
+        self._scale = None
+
+    def fit(self, features: np.ndarray) -> "_StandardScaler":
+        self._mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        self._scale = np.where(scale == 0, 1, scale).astype(scale.dtype)
+        return self
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        return (features - self._mean) / self._scale
+
+    def fit_transform(self, features: np.ndarray) -> np.ndarray:
+        return self.fit(features).transform(features)
+
+    def inverse_transform(self, features: np.ndarray) -> np.ndarray:
+        return features * self._scale + self._mean
+
+
+class _PCA:
+    """NumPy implementation of the subset of `sklearn.decomposition.PCA`
+    used by the PCA filters.  An integer number of components keeps that
+    many components, a float in (0, 1) keeps enough components to explain
+    that fraction of the variance, and None keeps all components"""
+
+    def __init__(self, num_components: Union[int, float, None]) -> None:
+        self._num_components = num_components
+        self._mean = None
+        self._components = None
+
+    def fit(self, features: np.ndarray) -> "_PCA":
+        self._fit(features)
+        return self
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        return (features - self._mean) @ self._components.T
+
+    def fit_transform(self, features: np.ndarray) -> np.ndarray:
+        u, s, k = self._fit(features)
+        return u[:, :k] * s[:k]
+
+    def inverse_transform(self, transformed: np.ndarray) -> np.ndarray:
+        return transformed @ self._components + self._mean
+
+    def _fit(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+        self._mean = features.mean(axis=0)
+        centered = features - self._mean
+        u, s, vt = np.linalg.svd(centered, full_matrices=False)
+        u, vt = self._flip_signs(u, vt)
+        k = self._select_num_components(s, len(features))
+        self._components = vt[:k]
+        return u, s, k
+
+    def _flip_signs(
+        self, u: np.ndarray, vt: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Makes the output deterministic, following the sign convention
+        used by sklearn"""
+        max_abs_rows = np.argmax(np.abs(u), axis=0)
+        signs = np.sign(u[max_abs_rows, range(u.shape[1])])
+        signs[signs == 0] = 1
+        return u * signs, vt * signs[:, np.newaxis]
+
+    def _select_num_components(self, s: np.ndarray, num_samples: int) -> int:
+        num_components = self._num_components
+        if num_components is None:
+            return len(s)
+        if 0 < num_components < 1:
+            variance = s**2 / max(num_samples - 1, 1)
+            ratio = np.cumsum(variance / variance.sum())
+            return int(np.searchsorted(ratio, num_components, side="right")) + 1
+        return int(num_components)
+
+
+_PCA_BACKENDS = ("numpy", "sklearn")
+
+
+def _create_decomposition(
+    num_components: Union[int, float, None], backend: str
+) -> tuple:
+    """Creates a (scaler, pca) pair.  sklearn is only imported when it is
+    explicitly requested as the backend"""
+    if backend == "numpy":
+        return _StandardScaler(), _PCA(num_components)
+    if backend == "sklearn":
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+
+        return StandardScaler(), PCA(num_components)
+    raise ValueError("Unknown PCA backend: {}".format(backend))
+
+
 class NoiseFilter(SpectrumFilter):
     """Computes average across range dimension, and uses a threshold
     to zero out noise regions"""
 
-    def __init__(self, threshold: float, window_std: float) -> None:
+    def __init__(
+        self, threshold: float, window_std: float, backend: str = "numpy"
+    ) -> None:
+        if backend not in ("numpy", "scipy"):
+            raise ValueError("Unknown noise filter backend: {}".format(backend))
         self._threshold = threshold
         self._window_std = window_std
+        self._backend = backend
 
     def _filter(self, spectrum: np.ndarray) -> np.ndarray:
         average = spectrum.mean(axis=0)
         mask = np.where(average < self._threshold, 0, 1)
         length = spectrum.shape[-1]
-        window = sig.windows.gaussian(M=length, std=self._window_std * length)
-        mask = sig.convolve(mask, window, mode="same")
+        mask = self._smooth(mask, length, self._window_std * length)
         mask = (mask - mask.min()) / (mask.max() - mask.min())
         return mask * spectrum
 
+    def _smooth(self, mask: np.ndarray, length: int, std: float) -> np.ndarray:
+        if self._backend == "scipy":
+            from scipy import signal as sig
+
+            window = sig.windows.gaussian(M=length, std=std)
+            return sig.convolve(mask, window, mode="same")
+
+        n = np.arange(length) - (length - 1) / 2
+        window = np.exp(-0.5 * (n / std) ** 2)
+        return np.convolve(mask, window, mode="same")
+
 
 class PreFitPCAFilter(SpectrumFilter):
-    def __init__(self, spectra, num_components: int) -> None:
-        self._scaler = StandardScaler()
-        self._pca = PCA(num_components)
+    """Fits PCA once on a batch of spectra, then projects each filtered
+    spectrum onto the fitted components.  The default "numpy" backend
+    avoids importing sklearn; pass backend="sklearn" to use it instead"""
+
+    def __init__(
+        self, spectra, num_components: int, backend: str = "numpy"
+    ) -> None:
+        self._scaler, self._pca = _create_decomposition(num_components, backend)
         length = spectra.shape[-1]
         features = spectra.reshape((-1, length))
         features = self._scaler.fit_transform(features)
@@ -51,12 +183,18 @@ class PreFitPCAFilter(SpectrumFilter):
 
 
 class PCAFilter(SpectrumFilter):
-    def __init__(self, num_components: int) -> None:
+    """Fits PCA on each filtered spectrum individually and reconstructs it
+    from the leading components.  The default "numpy" backend avoids
+    importing sklearn; pass backend="sklearn" to use it instead"""
+
+    def __init__(self, num_components: int, backend: str = "numpy") -> None:
+        if backend not in _PCA_BACKENDS:
+            raise ValueError("Unknown PCA backend: {}".format(backend))
         self._num_components = num_components
+        self._backend = backend
 
     def _filter(self, spectrum: np.ndarray) -> np.ndarray:
-        pca = PCA(self._num_components)
-        scaler = StandardScaler()
+        scaler, pca = _create_decomposition(self._num_components, self._backend)
         feature = scaler.fit_transform(spectrum)
         transformed = pca.fit_transform(feature)
         filtered = pca.inverse_transform(transformed)
@@ -5,6 +5,31 @@ from collections import OrderedDict
 class CSFileHeader:
     """Stores all header information from Cross-Spectrum files"""
 
+    __slots__ = (
+        "version",
+        "timestamp",
+        "cskind",
+        "site_code",
+        "cover_minutes",
+        "deleted_source",
+        "override_source",
+        "start_freq_mhz",
+        "rep_freq_mhz",
+        "bandwidth_khz",
+        "sweep_up",
+        "num_doppler_cells",
+        "num_range_cells",
+        "first_range_cell",
+        "range_cell_dist_km",
+        "output_interval",
+        "create_type_code",
+        "creator_version",
+        "num_active_channels",
+        "num_spectra_channels",
+        "active_channels",
+        "blocks",
+    )
+
     def __init__(self) -> None:
         self.version = None
         self.timestamp = None
@@ -29,5 +54,20 @@ class CSFileHeader:
         self.active_channels = None
         self.blocks = OrderedDict()
 
+    @classmethod
+    def _from_fields(cls, fields: tuple) -> "CSFileHeader":
+        header = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, fields):
+            setattr(header, name, value)
+        return header
+
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        fields = tuple(getattr(self, name) for name in self.__slots__)
+        return (self._from_fields, (fields,))
+
+    def as_dict(self) -> dict:
+        """Maps each header field name to its value"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
     def __repr__(self) -> str:
-        return pprint.pformat(self.__dict__)
+        return pprint.pformat(self.as_dict())
@@ -0,0 +1,343 @@
+"""Incremental ingest of Cross-Spectrum files as they arrive.
+
+Polls an incoming directory for new files, waits until their size and
+modification time stop changing, then loads, preprocesses and filters them
+and appends the result to a SpectrumStore, optionally building preview
+pyramids of each file on the way.  Ingesting a file only touches that file,
+so latency does not grow with the size of the archive.
+
+Takes the same JSON processing chain config as radarqc-batch."""
+
+import argparse
+import fnmatch
+import json
+import os
+import pickle
+import sys
+import time
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.batch import BatchConfig
+from radarqc.filtering import SpectrumFilter
+from radarqc.header import CSFileHeader
+from radarqc.preview import PreviewCache
+from radarqc.processing import SignalProcessor
+
+
+class SpectrumStore:
+    """Append-only on-disk store of spectra and headers, with the same
+    `spectra` and `headers` interface as DataSet.
+
+    Spectra are appended to a single raw file and read back through a
+    memory map, headers are appended as pickles, so adding a file never
+    rewrites existing data"""
+
+    _META = "store.json"
+    _SPECTRA = "spectra.bin"
+    _HEADERS = "headers.pkl"
+    _SOURCES = "sources.txt"
+
+    def __init__(self, directory: str, dtype: np.dtype = np.float32) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._shape = None
+        self._dtype = np.dtype(dtype)
+        self._headers = []
+        self._sources = []
+        self._headers_size = 0
+        self._sources_partial = False
+        self._spectra = None
+
+        if os.path.exists(self._path(self._META)):
+            self._read_meta()
+            self._headers = list(self._read_headers())
+            self._sources = self._read_sources()
+        self._truncate_partial()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._directory, name)
+
+    def _read_meta(self) -> None:
+        with open(self._path(self._META)) as f:
+            meta = json.load(f)
+        self._shape = tuple(meta["shape"])
+        self._dtype = np.dtype(meta["dtype"])
+
+    def _write_meta(self) -> None:
+        meta = {"shape": list(self._shape), "dtype": self._dtype.str}
+        with open(self._path(self._META), "w") as f:
+            json.dump(meta, f)
+
+    def _read_headers(self) -> Iterable[CSFileHeader]:
+        """Yields the complete header records, and leaves the size of the
+        file up to the end of the last one in `_headers_size`"""
+        self._headers_size = 0
+        if not os.path.exists(self._path(self._HEADERS)):
+            return
+        with open(self._path(self._HEADERS), "rb") as f:
+            while True:
+                try:
+                    header = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    return
+                self._headers_size = f.tell()
+                yield header
+
+    def _read_sources(self) -> List[str]:
+        """Complete lines of the sources file, setting `_sources_partial` if
+        it ends with a partial one"""
+        self._sources_partial = False
+        if not os.path.exists(self._path(self._SOURCES)):
+            return []
+        with open(self._path(self._SOURCES)) as f:
+            lines = f.read().split("\n")
+        self._sources_partial = lines[-1] != ""
+        return lines[:-1]
+
+    def _frame_size(self) -> int:
+        return int(np.prod(self._shape)) * self._dtype.itemsize
+
+    def _truncate_partial(self) -> None:
+        """Drops records left incomplete by an interrupted append, including
+        partially written ones, so that spectra, headers and sources always
+        line up and the next append starts at a record boundary"""
+        if self._shape is None:
+            return
+        path = self._path(self._SPECTRA)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        num_spectra = size // self._frame_size()
+        n = min(num_spectra, len(self._headers), len(self._sources))
+        if size != n * self._frame_size():
+            with open(path, "r+b") as f:
+                f.truncate(n * self._frame_size())
+
+        headers_path = self._path(self._HEADERS)
+        headers_size = 0
+        if os.path.exists(headers_path):
+            headers_size = os.path.getsize(headers_path)
+        if len(self._headers) != n or headers_size != self._headers_size:
+            del self._headers[n:]
+            with open(headers_path, "wb") as f:
+                for header in self._headers:
+                    pickle.dump(header, f)
+                self._headers_size = f.tell()
+
+        if len(self._sources) != n or self._sources_partial:
+            del self._sources[n:]
+            with open(self._path(self._SOURCES), "w") as f:
+                f.writelines(source + "\n" for source in self._sources)
+            self._sources_partial = False
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    @property
+    def spectra(self) -> np.ndarray:
+        """Array size is (N, num_range, num_doppler), memory mapped from disk"""
+        if self._shape is None:
+            return np.empty((0, 0, 0), dtype=self._dtype)
+        if len(self) == 0:
+            return np.empty((0,) + self._shape, dtype=self._dtype)
+        if self._spectra is None or len(self._spectra) != len(self):
+            self._spectra = np.memmap(
+                self._path(self._SPECTRA),
+                dtype=self._dtype,
+                mode="r",
+                shape=(len(self),) + self._shape,
+            )
+        return self._spectra
+
+    @property
+    def headers(self) -> Iterable[CSFileHeader]:
+        """Header of each stored spectrum, in the order they were added"""
+        return self._headers
+
+    @property
+    def sources(self) -> Iterable[str]:
+        """Name of the file each stored spectrum was ingested from"""
+        return self._sources
+
+    def append(
+        self, header: CSFileHeader, spectrum: np.ndarray, source: str = ""
+    ) -> None:
+        spectrum = np.ascontiguousarray(spectrum, dtype=self._dtype)
+        if self._shape is None:
+            self._shape = spectrum.shape
+            self._write_meta()
+        elif spectrum.shape != self._shape:
+            raise ValueError(
+                "Spectrum shape {} does not match store shape {}".format(
+                    spectrum.shape, self._shape
+                )
+            )
+
+        try:
+            with open(self._path(self._SPECTRA), "ab") as f:
+                f.write(spectrum.tobytes())
+            with open(self._path(self._HEADERS), "ab") as f:
+                pickle.dump(header, f)
+                headers_size = f.tell()
+            with open(self._path(self._SOURCES), "a") as f:
+                f.write(source + "\n")
+        except BaseException:
+            # Roll back whatever part of the record was written, so the next
+            # append starts at a record boundary
+            self._sources_partial = True
+            self._truncate_partial()
+            raise
+        self._headers_size = headers_size
+        self._headers.append(header)
+        self._sources.append(source)
+
+
+class IngestWatcher:
+    """Polls a directory and ingests each new file into a SpectrumStore once
+    its size and modification time have been unchanged for `stable_polls`
+    consecutive polls.  Files already in the store are never reprocessed.
+    If `previews` is given, the previews of each file are built from the
+    decoded file, so it must use the same preprocessing"""
+
+    def __init__(
+        self,
+        incoming_dir: str,
+        store: SpectrumStore,
+        preprocess: SignalProcessor,
+        spectrum_filter: SpectrumFilter = None,
+        channel: str = "antenna3",
+        pattern: str = "*.cs",
+        stable_polls: int = 1,
+        previews: PreviewCache = None,
+    ) -> None:
+        self._incoming_dir = incoming_dir
+        self._store = store
+        self._preprocess = preprocess
+        self._filter = spectrum_filter
+        self._channel = channel
+        self._pattern = pattern
+        self._stable_polls = stable_polls
+        self._previews = previews
+        self._ingested = set(store.sources)
+        self._candidates = {}
+
+    def _scan(self) -> Dict[str, Tuple[int, float]]:
+        found = {}
+        with os.scandir(self._incoming_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in self._ingested or not entry.is_file():
+                    continue
+                if fnmatch.fnmatch(name, self._pattern):
+                    stat = entry.stat()
+                    found[name] = (stat.st_size, stat.st_mtime)
+        return found
+
+    def _find_stable(self) -> List[str]:
+        """Updates the stability counters, and returns the files that are
+        ready, ordered by name"""
+        candidates = {}
+        for name, signature in self._scan().items():
+            previous, count = self._candidates.get(name, (None, -1))
+            count = count + 1 if signature == previous else 0
+            candidates[name] = (signature, count)
+        self._candidates = candidates
+        return sorted(
+            name
+            for name, (_, count) in candidates.items()
+            if count >= self._stable_polls
+        )
+
+    def ingest(self, name: str) -> None:
+        path = os.path.join(self._incoming_dir, name)
+        with open(path, "rb") as f:
+            cs = csfile.load(f, self._preprocess)
+        if self._previews is not None:
+            self._previews.add(path, cs)
+        spectrum = getattr(cs, self._channel)
+        if self._filter is not None:
+            spectrum = self._filter(spectrum)
+        self._store.append(cs.header, spectrum, name)
+        self._ingested.add(name)
+        self._candidates.pop(name, None)
+
+    def poll(self) -> List[str]:
+        """Ingests all files that became stable, and returns their names.
+        A file that fails to load is reported and retried on the next poll"""
+        ingested = []
+        for name in self._find_stable():
+            try:
+                self.ingest(name)
+            except Exception as e:
+                print("Failed {}: {}".format(name, e), file=sys.stderr)
+                continue
+            ingested.append(name)
+        return ingested
+
+    def run(self, interval: float, max_polls: int = None) -> None:
+        num_polls = 0
+        while max_polls is None or num_polls < max_polls:
+            start = time.perf_counter()
+            for name in self.poll():
+                latency = time.perf_counter() - start
+                print(
+                    "Ingested {} ({:.3f} s)".format(name, latency), flush=True
+                )
+            num_polls += 1
+            time.sleep(max(interval - (time.perf_counter() - start), 0))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("incoming_dir", help="directory new files arrive in")
+    parser.add_argument("store_dir", help="directory of the spectrum store")
+    parser.add_argument("--config", help="JSON processing chain config")
+    parser.add_argument(
+        "--interval", type=float, default=30.0, help="seconds between polls"
+    )
+    parser.add_argument(
+        "--stable-polls",
+        type=int,
+        default=1,
+        help="polls a file must stay unchanged before it is ingested",
+    )
+    parser.add_argument(
+        "--pattern", default="*.cs", help="file name pattern to ingest"
+    )
+    parser.add_argument(
+        "--previews", help="directory to store preview pyramids in"
+    )
+    args = parser.parse_args(argv)
+
+    config = BatchConfig()
+    if args.config:
+        config = BatchConfig.from_file(args.config)
+    if len(config.channels) != 1:
+        parser.error("ingest stores exactly one channel")
+
+    preprocess, spectrum_filter = config.build()
+    previews = None
+    if args.previews:
+        previews = PreviewCache(args.previews, preprocess)
+    watcher = IngestWatcher(
+        args.incoming_dir,
+        SpectrumStore(args.store_dir),
+        preprocess,
+        spectrum_filter,
+        channel=config.channels[0],
+        pattern=args.pattern,
+        stable_polls=args.stable_polls,
+        previews=previews,
+    )
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
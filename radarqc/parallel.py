@@ -0,0 +1,310 @@
+import concurrent.futures
+import os
+import pickle
+
+from multiprocessing import shared_memory
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.dataset import DataSet
+from radarqc.filtering import SpectrumFilter
+from radarqc.processing import Identity, SignalProcessor
+
+
+class _SharedArray:
+    """Describes a numpy array stored in a named block of shared memory.
+    Only the name, shape and dtype are pickled when sent to a worker"""
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str) -> None:
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self._shm = None
+
+    @classmethod
+    def create(cls, shape: Tuple[int, ...], dtype: np.dtype) -> "_SharedArray":
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shared = cls(shm.name, tuple(shape), dtype.str)
+        shared._shm = shm
+        return shared
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def release(self) -> None:
+        """Closes and frees the shared memory, called by its creator"""
+        shm = self._shm or shared_memory.SharedMemory(name=self.name)
+        self._shm = None
+        shm.close()
+        shm.unlink()
+
+    def __getstate__(self) -> dict:
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+
+class _SharedMemory(shared_memory.SharedMemory):
+    """SharedMemory whose close does not fail while arrays still view the
+    memory.  Closing then still closes the file descriptor but leaves the
+    mapping to the views, which unmap it when the last of them is freed"""
+
+    def close(self) -> None:
+        try:
+            super().close()
+        except BufferError:
+            self._buf = None
+            self._mmap = None
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+class SharedPickle:
+    """Pickles an object with protocol 5, placing its out-of-band buffers,
+    such as the spectrum of a CSFile, in shared memory.
+
+    Only the small in-band pickle and the name of the shared memory block
+    are copied when a SharedPickle is sent to another process, and `load`
+    rebuilds the object with arrays that view the shared memory directly.
+    Those arrays keep the memory mapped for as long as they are alive, even
+    after the SharedPickle is closed or freed.  Receivers may call `close`
+    once they are done loading, and the creator must call `release` once
+    every receiver has attached to the memory."""
+
+    def __init__(self, obj) -> None:
+        buffers = []
+        self._data = pickle.dumps(
+            obj, protocol=5, buffer_callback=buffers.append
+        )
+        raws = [buffer.raw() for buffer in buffers]
+        self._sizes = [raw.nbytes for raw in raws]
+        self._shm = _SharedMemory(create=True, size=max(sum(self._sizes), 1))
+        self._name = self._shm.name
+        offset = 0
+        for raw, size in zip(raws, self._sizes):
+            self._shm.buf[offset : offset + size] = raw
+            offset += size
+
+    def load(self):
+        """Rebuilds the object, with arrays that view the shared memory"""
+        if self._shm is None:
+            self._shm = _SharedMemory(name=self._name)
+        buffers, offset = [], 0
+        for size in self._sizes:
+            buffers.append(self._shm.buf[offset : offset + size])
+            offset += size
+        return pickle.loads(self._data, buffers=buffers)
+
+    def close(self) -> None:
+        """Drops this process's handle on the shared memory.  Objects
+        already loaded stay valid"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def release(self) -> None:
+        """Frees the shared memory, called by its creator.  Receivers that
+        are already attached keep their mapping until they are done"""
+        shm = self._shm or _SharedMemory(name=self._name)
+        self._shm = None
+        shm.unlink()
+        shm.close()
+
+    def __getstate__(self) -> dict:
+        return {"data": self._data, "sizes": self._sizes, "name": self._name}
+
+    def __setstate__(self, state: dict) -> None:
+        self._data = state["data"]
+        self._sizes = state["sizes"]
+        self._name = state["name"]
+        self._shm = None
+
+
+class _ArraySource:
+    """Reads input spectra from a stack held in shared memory"""
+
+    def __init__(self, shared: _SharedArray) -> None:
+        self._shared = shared
+
+    def __len__(self) -> int:
+        return self._shared.shape[0]
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self._shared.array[i]
+
+
+class _FileSource:
+    """Loads input spectra from Cross-Spectrum files inside the worker, so
+    only the file paths travel between processes"""
+
+    def __init__(
+        self, paths: List[str], preprocess: SignalProcessor, channel: str
+    ) -> None:
+        self._paths = paths
+        self._preprocess = preprocess
+        self._channel = channel
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        with open(self._paths[i], "rb") as f:
+            cs = csfile.load(f, self._preprocess)
+        return getattr(cs, self._channel)
+
+
+_WORKER_STATE = {}
+
+
+def _init_worker(
+    spectrum_filter: SpectrumFilter, source, output: _SharedArray
+) -> None:
+    _WORKER_STATE["filter"] = spectrum_filter
+    _WORKER_STATE["source"] = source
+    _WORKER_STATE["output"] = output
+
+
+def _filter_range(
+    spectrum_filter: SpectrumFilter,
+    source,
+    out: np.ndarray,
+    start: int,
+    stop: int,
+) -> int:
+    for i in range(start, stop):
+        out[i] = spectrum_filter(source[i])
+    return stop - start
+
+
+def _filter_chunk(start: int, stop: int) -> int:
+    output = _WORKER_STATE["output"]
+    return _filter_range(
+        _WORKER_STATE["filter"],
+        _WORKER_STATE["source"],
+        output.array,
+        start,
+        stop,
+    )
+
+
+class FilterEngine:
+    """Applies a spectrum filter to every spectrum in a stack, DataSet, or
+    list of Cross-Spectrum files using a pool of worker processes.
+
+    Input and output stacks are shared with the workers through shared
+    memory, so only chunk indices are sent between processes.  Use
+    `CompositeFilter` to apply a chain of filters in a single pass.
+
+    Each worker runs its own numpy, so limiting BLAS threads (for example
+    with OMP_NUM_THREADS=1) avoids oversubscribing cores when running
+    PCA based filters."""
+
+    def __init__(
+        self,
+        spectrum_filter: SpectrumFilter,
+        num_workers: int = None,
+        chunk_size: int = 4,
+    ) -> None:
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self._filter = spectrum_filter
+        self._num_workers = num_workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+
+    @property
+    def num_workers(self) -> int:
+        """Number of worker processes used for filtering"""
+        return self._num_workers
+
+    @property
+    def chunk_size(self) -> int:
+        """Number of spectra handed to a worker per task"""
+        return self._chunk_size
+
+    def apply(self, spectra: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Filters a stack of spectra with shape (N, num_range, num_doppler).
+        The result is written into `out` if given, otherwise into a newly
+        allocated array of the same shape and dtype as the input"""
+        if out is None:
+            out = np.empty_like(spectra)
+        if self._num_workers == 1 or len(spectra) <= self._chunk_size:
+            _filter_range(self._filter, spectra, out, 0, len(spectra))
+            return out
+
+        shared = _SharedArray.create(spectra.shape, spectra.dtype)
+        try:
+            shared.array[:] = spectra
+            self._run(_ArraySource(shared), out)
+        finally:
+            shared.release()
+        return out
+
+    def apply_dataset(self, dataset: DataSet) -> np.ndarray:
+        """Filters every spectrum of a DataSet"""
+        return self.apply(dataset.spectra)
+
+    def apply_files(
+        self,
+        paths: Iterable[str],
+        preprocess: SignalProcessor = None,
+        channel: str = "antenna3",
+        dtype: np.dtype = np.float32,
+        out: np.ndarray = None,
+    ) -> np.ndarray:
+        """Loads and filters one channel from each Cross-Spectrum file.
+        Files are decoded inside the workers, and all files must have the
+        same number of range and doppler cells as the first one"""
+        if preprocess is None:
+            preprocess = Identity()
+
+        paths = list(paths)
+        source = _FileSource(paths, preprocess, channel)
+        if out is None:
+            out = np.empty(self._stack_shape(paths), dtype=dtype)
+        if self._num_workers == 1 or len(paths) <= self._chunk_size:
+            _filter_range(self._filter, source, out, 0, len(paths))
+            return out
+
+        self._run(source, out)
+        return out
+
+    def _stack_shape(self, paths: List[str]) -> Tuple[int, int, int]:
+        if not paths:
+            return (0, 0, 0)
+        with open(paths[0], "rb") as f:
+            header = csfile.load_header(f)
+        return (len(paths), header.num_range_cells, header.num_doppler_cells)
+
+    def _chunks(self, length: int) -> Iterable[Tuple[int, int]]:
+        for start in range(0, length, self._chunk_size):
+            yield start, min(start + self._chunk_size, length)
+
+    def _run(self, source, out: np.ndarray) -> None:
+        shared = _SharedArray.create(out.shape, out.dtype)
+        try:
+            num_workers = min(
+                self._num_workers, -(-len(out) // self._chunk_size)
+            )
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_worker,
+                initargs=(self._filter, source, shared),
+            ) as pool:
+                futures = [
+                    pool.submit(_filter_chunk, start, stop)
+                    for start, stop in self._chunks(len(out))
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            out[:] = shared.array
+        finally:
+            shared.release()
@@ -0,0 +1,237 @@
+"""Multi-resolution previews of Cross-Spectrum files.
+
+A Pyramid holds min, max and mean decimations of a channel by factors of
+2, 4 and 8 along range and doppler.  PreviewCache keeps the pyramids of
+each file in a small sidecar file, so overviews of many files can be drawn
+without decoding them, from the smallest level that still fills the view."""
+
+import hashlib
+import os
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from radarqc import csfile
+from radarqc.csfile import CSFile
+from radarqc.processing import Identity, SignalProcessor
+
+FACTORS = (2, 4, 8)
+
+
+def _decimate(
+    low: np.ndarray, high: np.ndarray, total: np.ndarray, count: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Halves the last two axes, padding odd sizes with cells that do not
+    contribute to any statistic"""
+
+    def reduce(array, fill, fn):
+        *leading, num_range, num_doppler = array.shape
+        pad = [(0, 0)] * len(leading) + [
+            (0, num_range % 2),
+            (0, num_doppler % 2),
+        ]
+        padded = np.pad(array, pad, constant_values=fill)
+        shape = (num_range + 1) // 2, 2, (num_doppler + 1) // 2, 2
+        return fn(padded.reshape(tuple(leading) + shape), axis=(-3, -1))
+
+    return (
+        reduce(low, np.inf, np.min),
+        reduce(high, -np.inf, np.max),
+        reduce(total, 0, np.sum),
+        reduce(count, 0, np.sum),
+    )
+
+
+def _select(
+    shape: Tuple[int, int], factors: Iterable[int], view_shape: Tuple[int, int]
+) -> int:
+    selected = 1
+    for factor in factors:
+        level_shape = [-(-n // factor) for n in shape]
+        if all(n >= v for n, v in zip(level_shape, view_shape)):
+            selected = max(selected, factor)
+    return selected
+
+
+class Pyramid:
+    """Decimated min, max and mean levels of one channel, for a single
+    spectrum or a stack with shape (..., num_range, num_doppler).  Complex
+    cross-spectra are decimated by magnitude"""
+
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        levels: Dict[int, Dict[str, np.ndarray]],
+    ) -> None:
+        self._shape = tuple(shape)
+        self._levels = levels
+
+    @classmethod
+    def build(
+        cls, spectrum: np.ndarray, factors: Iterable[int] = FACTORS
+    ) -> "Pyramid":
+        factors = sorted(factors)
+        if any(factor & (factor - 1) or factor < 2 for factor in factors):
+            raise ValueError("Factors must be powers of 2 greater than 1")
+
+        spectrum = np.asarray(spectrum)
+        if np.iscomplexobj(spectrum):
+            spectrum = np.abs(spectrum)
+        low = high = total = spectrum.astype(np.float64)
+        count = np.ones(spectrum.shape[-2:], dtype=np.int64)
+
+        levels = {}
+        factor = 1
+        for target in factors:
+            # Each level is decimated from the previous one, so every input
+            # cell is only reduced once
+            while factor < target:
+                low, high, total, count = _decimate(low, high, total, count)
+                factor *= 2
+            levels[factor] = {
+                "min": low.astype(np.float32),
+                "max": high.astype(np.float32),
+                "mean": (total / count).astype(np.float32),
+            }
+        return cls(spectrum.shape[-2:], levels)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """(num_range, num_doppler) at full resolution"""
+        return self._shape
+
+    @property
+    def factors(self) -> Tuple[int, ...]:
+        return tuple(sorted(self._levels))
+
+    def level(self, factor: int, statistic: str = "mean") -> np.ndarray:
+        return self._levels[factor][statistic]
+
+    def select(self, view_shape: Tuple[int, int]) -> int:
+        """Largest factor whose level still has at least view_shape cells,
+        or 1 if only full resolution does"""
+        return _select(self._shape, self.factors, view_shape)
+
+    def to_arrays(self, prefix: str = "") -> Dict[str, np.ndarray]:
+        arrays = {prefix + "shape": np.array(self._shape)}
+        for factor, statistics in self._levels.items():
+            for statistic, array in statistics.items():
+                arrays["{}{}/{}".format(prefix, factor, statistic)] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(
+        cls, arrays: Dict[str, np.ndarray], prefix: str = ""
+    ) -> "Pyramid":
+        levels = {}
+        for key in arrays:
+            if not key.startswith(prefix) or key == prefix + "shape":
+                continue
+            factor, statistic = key[len(prefix) :].split("/")
+            levels.setdefault(int(factor), {})[statistic] = arrays[key]
+        return cls(tuple(arrays[prefix + "shape"]), levels)
+
+
+class PreviewCache:
+    """Sidecar cache of the pyramids of each file, stored as one .npz per
+    file in `directory`.
+
+    Like CSFileCache, entries are keyed by path, modification time, size
+    and the fingerprint of the preprocessing, so previews of changed files are
+    rebuilt.  Sidecars are written to a temporary file and renamed, so a
+    reader never sees a partial one"""
+
+    def __init__(
+        self,
+        directory: str,
+        preprocess: SignalProcessor = None,
+        channels: Iterable[str] = ("antenna1", "antenna2", "antenna3"),
+        factors: Iterable[int] = FACTORS,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._preprocess = Identity() if preprocess is None else preprocess
+        self._fingerprint = self._preprocess.fingerprint()
+        if self._fingerprint is None:
+            raise ValueError(
+                "Previews need preprocessing that can be fingerprinted"
+            )
+        self._channels = tuple(channels)
+        self._factors = tuple(sorted(factors))
+
+    def sidecar_path(self, path: str) -> str:
+        stat = os.stat(path)
+        key = repr(
+            (
+                os.path.abspath(path),
+                stat.st_mtime_ns,
+                stat.st_size,
+                self._fingerprint,
+                self._channels,
+                self._factors,
+            )
+        )
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self._directory, digest + ".npz")
+
+    def add(self, path: str, cs: CSFile = None) -> Dict[str, Pyramid]:
+        """Builds and stores the previews of a file.  Pass `cs` when the file
+        was just loaded, e.g. during ingest, to avoid decoding it again.  It
+        must have been loaded with this cache's preprocessing"""
+        sidecar = self.sidecar_path(path)
+        if cs is None:
+            with open(path, "rb") as f:
+                cs = csfile.load(f, self._preprocess)
+
+        pyramids = {
+            channel: Pyramid.build(getattr(cs, channel), self._factors)
+            for channel in self._channels
+        }
+        arrays = {}
+        for channel, pyramid in pyramids.items():
+            arrays.update(pyramid.to_arrays(channel + "/"))
+        partial = sidecar + ".part"
+        with open(partial, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(partial, sidecar)
+        return pyramids
+
+    def get(self, path: str) -> Dict[str, Pyramid]:
+        """Previews of every channel of a file, built on first access"""
+        sidecar = self.sidecar_path(path)
+        if not os.path.exists(sidecar):
+            return self.add(path)
+        with np.load(sidecar) as arrays:
+            arrays = dict(arrays)
+        return {
+            channel: Pyramid.from_arrays(arrays, channel + "/")
+            for channel in self._channels
+        }
+
+    def view(
+        self,
+        path: str,
+        channel: str,
+        view_shape: Tuple[int, int],
+        statistic: str = "mean",
+    ) -> Tuple[np.ndarray, int]:
+        """Returns the smallest level of a channel with at least view_shape
+        cells, and its decimation factor.  Falls back to decoding the file
+        at full resolution when the view is larger than every level"""
+        sidecar = self.sidecar_path(path)
+        if not os.path.exists(sidecar):
+            self.add(path)
+        # Members of an .npz are read on access, so only one level is loaded
+        with np.load(sidecar) as arrays:
+            shape = tuple(arrays[channel + "/shape"])
+            factor = _select(shape, self._factors, view_shape)
+            if factor > 1:
+                key = "{}/{}/{}".format(channel, factor, statistic)
+                return arrays[key], factor
+
+        with open(path, "rb") as f:
+            spectrum = getattr(csfile.load(f, self._preprocess), channel)
+        if np.iscomplexobj(spectrum):
+            spectrum = np.abs(spectrum)
+        return spectrum, 1
@@ -1,6 +1,11 @@
 import abc
+import hashlib
 import numpy as np
 
+from typing import Optional
+
+from radarqc import profiling
+
 
 class SignalProcessor(abc.ABC):
     """Base class for representing a signal processor, used to process
@@ -9,11 +14,67 @@ class SignalProcessor(abc.ABC):
     def __call__(self, signal: np.ndarray) -> np.ndarray:
         return self._process(signal)
 
+    def __repr__(self) -> str:
+        """Describes the processor and its parameters, so that processors
+        configured the same way have the same representation"""
+        params = ", ".join(
+            "{}={!r}".format(name.lstrip("_"), value)
+            for name, value in sorted(vars(self).items())
+        )
+        return "{}({})".format(self.__class__.__name__, params)
+
+    def fingerprint(self) -> Optional[str]:
+        """Hash of the processor class and all of its parameters, including
+        the full contents of array parameters, or None if a parameter has a
+        type that cannot be hashed reliably.  Caches of processed data are
+        keyed by it, and do not cache processors that return None.
+        Subclasses with such parameters may override this"""
+        cls = type(self)
+        digest = hashlib.sha1(
+            "{}.{}".format(cls.__module__, cls.__qualname__).encode()
+        )
+        for name, value in sorted(vars(self).items()):
+            digest.update(name.encode())
+            if not _update_hash(digest, value):
+                return None
+        return digest.hexdigest()
+
     @abc.abstractmethod
     def _process(self, signal: np.ndarray) -> np.ndarray:
         """Subclasses will override this functionality"""
 
 
+def _update_hash(digest, value) -> bool:
+    digest.update(type(value).__qualname__.encode())
+    if isinstance(value, SignalProcessor):
+        fingerprint = value.fingerprint()
+        if fingerprint is None:
+            return False
+        digest.update(fingerprint.encode())
+        return True
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return False
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+        return True
+    if isinstance(value, (list, tuple)):
+        digest.update(str(len(value)).encode())
+        return all(_update_hash(digest, item) for item in value)
+    if isinstance(value, dict):
+        digest.update(str(len(value)).encode())
+        return all(
+            _update_hash(digest, key) and _update_hash(digest, item)
+            for key, item in sorted(value.items(), key=repr)
+        )
+    if value is None or isinstance(
+        value, (bool, int, float, complex, str, bytes, np.generic)
+    ):
+        digest.update(repr(value).encode())
+        return True
+    return False
+
+
 class GainCalculator(SignalProcessor):
     """Convert the signal from raw Voltages into dB, given some
     reference gain as a baseline"""
@@ -60,7 +121,9 @@ class CompositeProcessor(SignalProcessor):
 
     def _process(self, signal: np.ndarray) -> np.ndarray:
         for process in self._processors:
-            signal = process(signal)
+            with profiling.stage("processing", process) as stage:
+                stage.nbytes = getattr(signal, "nbytes", 0)
+                signal = process(signal)
         return signal
 
 
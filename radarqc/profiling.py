@@ -0,0 +1,233 @@
+import contextlib
+import threading
+import time
+import tracemalloc
+
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+class StageRecord:
+    """Measurements from a single execution of an instrumented stage.
+    `peak_bytes` is the most memory the stage had allocated at once, counted
+    from its start, including temporaries it freed before returning, and
+    `allocated_bytes` is the net memory it retained.  Both are only measured
+    when allocation tracking is enabled"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self.nbytes = 0
+        self.allocated_bytes = 0
+        self.peak_bytes = 0
+
+    def __repr__(self) -> str:
+        return (
+            "StageRecord({!r}, seconds={}, nbytes={}, allocated={}, "
+            "peak={})".format(
+                self.name,
+                self.seconds,
+                self.nbytes,
+                self.allocated_bytes,
+                self.peak_bytes,
+            )
+        )
+
+
+class StageStats:
+    """Aggregated statistics over every execution of a stage.  Bytes are
+    summed over executions, except `peak_bytes`, the largest peak of any
+    single execution"""
+
+    def __init__(self, name: str, records: List[StageRecord]) -> None:
+        seconds = np.array([record.seconds for record in records])
+        self.name = name
+        self.count = len(records)
+        self.total_seconds = float(seconds.sum())
+        self.p50_seconds = float(np.percentile(seconds, 50))
+        self.p99_seconds = float(np.percentile(seconds, 99))
+        self.nbytes = sum(record.nbytes for record in records)
+        self.allocated_bytes = sum(record.allocated_bytes for record in records)
+        self.peak_bytes = max(record.peak_bytes for record in records)
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class Profiler:
+    """Collects a StageRecord for every instrumented stage executed while
+    the profiler is active"""
+
+    def __init__(self, track_allocations: bool = False) -> None:
+        self._track_allocations = track_allocations
+        self._records = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @property
+    def track_allocations(self) -> bool:
+        """True if memory allocations are measured using tracemalloc"""
+        return self._track_allocations
+
+    def record(self, record: StageRecord) -> None:
+        with self._lock:
+            self._records[record.name].append(record)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def stats(self) -> Dict[str, StageStats]:
+        """Statistics for each stage, keyed by stage name"""
+        with self._lock:
+            records = {name: list(r) for name, r in self._records.items()}
+        return {
+            name: StageStats(name, stage_records)
+            for name, stage_records in sorted(records.items())
+        }
+
+    def report(self) -> str:
+        line = "{:<36} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}"
+        titles = (
+            "count",
+            "total s",
+            "p50 ms",
+            "p99 ms",
+            "MB",
+            "alloc MB",
+            "peak MB",
+        )
+        lines = [line.format("stage", *titles), "-" * 113]
+        for stats in self.stats().values():
+            lines.append(
+                line.format(
+                    stats.name,
+                    stats.count,
+                    "{:.4f}".format(stats.total_seconds),
+                    "{:.3f}".format(stats.p50_seconds * 1000),
+                    "{:.3f}".format(stats.p99_seconds * 1000),
+                    "{:.2f}".format(stats.nbytes / (1024 * 1024)),
+                    "{:.2f}".format(stats.allocated_bytes / (1024 * 1024)),
+                    "{:.2f}".format(stats.peak_bytes / (1024 * 1024)),
+                )
+            )
+        return "\n".join(lines)
+
+
+_PROFILERS = []
+_CALLBACKS = []
+
+
+class _NullStage:
+    """Returned by `stage` when nothing is listening, so that disabled
+    instrumentation costs a single function call"""
+
+    nbytes = 0
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __setattr__(self, name: str, value) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+# Stages being executed by each thread, innermost last
+_ACTIVE = threading.local()
+
+
+class _Stage:
+    def __init__(self, name: str) -> None:
+        self._record = StageRecord(name)
+        self._track_allocations = tracemalloc.is_tracing() and any(
+            profiler.track_allocations for profiler in _PROFILERS
+        )
+        self._start = 0.0
+        self._start_memory = 0
+        self._peak = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._record.nbytes
+
+    @nbytes.setter
+    def nbytes(self, value: int) -> None:
+        self._record.nbytes = value
+
+    def __enter__(self) -> "_Stage":
+        if self._track_allocations:
+            stack = getattr(_ACTIVE, "stages", None)
+            if stack is None:
+                stack = _ACTIVE.stages = []
+            # Resetting the peak would lose the peak of enclosing stages so
+            # far, so it is saved in them first
+            _, peak = tracemalloc.get_traced_memory()
+            for outer in stack:
+                outer._peak = max(outer._peak, peak)
+            stack.append(self)
+            tracemalloc.reset_peak()
+            self._start_memory, self._peak = tracemalloc.get_traced_memory()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        record = self._record
+        record.seconds = time.perf_counter() - self._start
+        if self._track_allocations:
+            memory, peak = tracemalloc.get_traced_memory()
+            record.allocated_bytes = max(memory - self._start_memory, 0)
+            peak = max(self._peak, peak)
+            record.peak_bytes = max(peak - self._start_memory, 0)
+            _ACTIVE.stages.remove(self)
+        for profiler in list(_PROFILERS):
+            profiler.record(record)
+        for callback in list(_CALLBACKS):
+            callback(record)
+
+
+def stage(name: str, obj=None):
+    """Context manager timing the enclosed stage.  If `obj` is given, its
+    class name is appended to the stage name.  Set `nbytes` on the returned
+    object to record the bytes read, written or processed by the stage"""
+    if not _PROFILERS and not _CALLBACKS:
+        return _NULL_STAGE
+    if obj is not None:
+        name = "{}.{}".format(name, obj.__class__.__name__)
+    return _Stage(name)
+
+
+def add_callback(callback: Callable[[StageRecord], None]) -> None:
+    """Registers a function called with the StageRecord of every stage"""
+    _CALLBACKS.append(callback)
+
+
+def remove_callback(callback: Callable[[StageRecord], None]) -> None:
+    _CALLBACKS.remove(callback)
+
+
+@contextlib.contextmanager
+def profile(track_allocations: bool = False):
+    """Records all instrumented stages executed inside the block, e.g.
+
+    with profiling.profile() as profiler:
+        cs = csfile.load(f, preprocess)
+    print(profiler.report())
+
+    If `track_allocations` is set, tracemalloc is started for the duration
+    of the block, which slows down execution considerably"""
+    profiler = Profiler(track_allocations)
+    started_tracing = track_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _PROFILERS.append(profiler)
+    try:
+        yield profiler
+    finally:
+        _PROFILERS.remove(profiler)
+        if started_tracing:
+            tracemalloc.stop()
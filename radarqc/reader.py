@@ -8,6 +8,7 @@ from typing import BinaryIO, Tuple
 
 import numpy as np
 
+from radarqc import profiling
 from radarqc.header import CSFileHeader
 from radarqc.processing import SignalProcessor
 from radarqc.serialization import BinaryReader, ByteOrder
@@ -45,6 +46,13 @@ class CSFileReader:
     ) -> Tuple[CSFileHeader, Spectrum]:
         return self._read_cs_buff(f, preprocess)
 
+    def load_header(self, f: BinaryIO) -> CSFileHeader:
+        """Parses only the file header, leaving the spectrum data unread"""
+        readers = {6: self._read_header_v6}
+        version = self._read_version(f)
+        read_header = readers[version]
+        return read_header(BinaryReader(f, ByteOrder.BIG_ENDIAN))
+
     def _parse_timestamp(self, seconds: int) -> datetime.datetime:
         start = datetime.datetime(year=1904, month=1, day=1)
         delta = datetime.timedelta(seconds=seconds)
@@ -72,8 +80,14 @@ class CSFileReader:
         self, f: BinaryIO, preprocess: SignalProcessor
     ) -> Tuple[CSFileHeader, Spectrum]:
         reader = BinaryReader(f, ByteOrder.BIG_ENDIAN)
-        header = self._read_header_v6(reader)
-        spectrum = self._read_spectrum(reader, header, preprocess)
+        with profiling.stage("reader.header") as stage:
+            start = f.tell()
+            header = self._read_header_v6(reader)
+            stage.nbytes = f.tell() - start
+        with profiling.stage("reader.spectrum") as stage:
+            start = f.tell()
+            spectrum = self._read_spectrum(reader, header, preprocess)
+            stage.nbytes = f.tell() - start
         return header, spectrum
 
     def _read_header_v6(self, reader: BinaryReader) -> CSFileHeader:
@@ -134,33 +148,26 @@ class CSFileReader:
         header: CSFileHeader,
         preprocess: SignalProcessor,
     ) -> Spectrum:
-        a1, a2, a3, c12, c13, c23, q = [], [], [], [], [], [], []
-        for _ in range(header.num_range_cells):
-            a1.append(self._read_real_row(reader, header))
-            a2.append(self._read_real_row(reader, header))
-            a3.append(self._read_real_row(reader, header))
-            c12.append(self._read_complex_row(reader, header))
-            c13.append(self._read_complex_row(reader, header))
-            c23.append(self._read_complex_row(reader, header))
-            if header.cskind >= 2:
-                q.append(self._read_real_row(reader, header))
-
-        a1 = np.stack(a1)
-        a2 = np.stack(a2)
-        a3 = np.stack(a3)
-        c12 = np.stack(c12)
-        c13 = np.stack(c13)
-        c23 = np.stack(c23)
+        # Each range cell is stored as one row holding a1, a2, a3, c12, c13,
+        # c23 and optionally q, where cross-spectra are (real, imag) pairs
+        num_real = 4 if header.cskind >= 2 else 3
+        width = header.num_doppler_cells
+        row_length = (num_real + 2 * 3) * width
+        rows = reader.read_array(
+            np.float32, header.num_range_cells * row_length
+        ).reshape((header.num_range_cells, row_length))
+
+        a1 = rows[:, 0:width]
+        a2 = rows[:, width : 2 * width]
+        a3 = rows[:, 2 * width : 3 * width]
+        c12 = self._complex_columns(rows, 3 * width, width)
+        c13 = self._complex_columns(rows, 5 * width, width)
+        c23 = self._complex_columns(rows, 7 * width, width)
+        q = rows[:, 9 * width : 10 * width] if header.cskind >= 2 else []
         return Spectrum(a1, a2, a3, c12, c13, c23, q, preprocess)
 
-    def _read_real_row(
-        self, reader: BinaryReader, header: CSFileHeader
-    ) -> np.ndarray:
-        floats = reader.read_float(header.num_doppler_cells)
-        return np.array(floats, dtype=np.float32)
-
-    def _read_complex_row(
-        self, reader: BinaryReader, header: CSFileHeader
+    def _complex_columns(
+        self, rows: np.ndarray, start: int, width: int
     ) -> np.ndarray:
-        floats = reader.read_float(header.num_doppler_cells * 2)
-        return np.array(floats, dtype=np.float32).view(np.complex64)
+        columns = rows[:, start : start + 2 * width]
+        return np.ascontiguousarray(columns).view(np.complex64)
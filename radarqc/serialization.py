@@ -3,6 +3,8 @@ import enum
 
 from typing import Any, BinaryIO, Iterable, Union
 
+import numpy as np
+
 
 class ByteOrder(enum.Enum):
     BIG_ENDIAN = 1
@@ -25,6 +27,10 @@ class _Formatter:
     def create_format(self, fmt: str, n: int) -> str:
         return "{}{}".format(self._byteorder, n * fmt)
 
+    def create_dtype(self, dtype: np.dtype) -> np.dtype:
+        byteorder = ">" if self._byteorder == "!" else self._byteorder
+        return np.dtype(dtype).newbyteorder(byteorder)
+
 
 class BinaryReader:
     def __init__(self, f: BinaryIO, byteorder: ByteOrder) -> None:
@@ -79,6 +85,14 @@ class BinaryReader:
     def read_double(self, n: int = 1) -> Union[float, Iterable[float]]:
         return self._read("d", size=8, n=n)
 
+    def read_array(self, dtype: np.dtype, n: int) -> np.ndarray:
+        """Reads n values in a single call, returned in native byte order"""
+        dtype = self._formatter.create_dtype(dtype)
+        buff = self._file.read(dtype.itemsize * n)
+        return np.frombuffer(buff, dtype=dtype, count=n).astype(
+            dtype.newbyteorder("=")
+        )
+
     def _read(self, fmt: str, size: int, n: int) -> Any:
         num_bytes = size * n
         buff = self._file.read(num_bytes)
@@ -139,6 +153,11 @@ class BinaryWriter:
     def write_double(self, buff: Union[float, Iterable[float]]) -> None:
         return self._write(buff, "d")
 
+    def write_array(self, array: np.ndarray) -> None:
+        """Writes all values of an array in a single call"""
+        dtype = self._formatter.create_dtype(array.dtype)
+        self._write_bytes(array.astype(dtype, copy=False).tobytes())
+
     def _write_bytes(self, buff: bytes) -> None:
         self._file.write(buff)
 
@@ -1,10 +1,48 @@
+import pickle
+
+from typing import Tuple
+
 import numpy as np
 
 from radarqc.processing import SignalProcessor
 
+_COMPLEX_CHANNELS = ("cross12", "cross13", "cross23")
+_REAL_CHANNELS = ("antenna1", "antenna2", "antenna3", "quality")
+
+
+def _channel(name: str, doc: str) -> property:
+    attr = "_" + name
+
+    def fget(self) -> np.ndarray:
+        return getattr(self, attr)
+
+    def fset(self, value: np.ndarray) -> None:
+        plane = getattr(self, attr)
+        if np.shape(value) != plane.shape:
+            raise ValueError(
+                "Cannot assign shape {} to {} with shape {}".format(
+                    np.shape(value), name, plane.shape
+                )
+            )
+        if np.iscomplexobj(value) and not np.iscomplexobj(plane):
+            raise ValueError("Cannot assign complex values to " + name)
+        plane[...] = value
+
+    return property(fget, fset, doc=doc)
+
 
 class Spectrum:
-    """Stores antenna spectra from Cross-Spectrum files."""
+    """Stores antenna spectra from Cross-Spectrum files.
+
+    All channels share one contiguous buffer, holding the cross-spectra as
+    complex64 planes followed by the antenna spectra and quality as float32
+    planes.  Channel attributes are views into the buffer, and assigning to
+    one copies the new values into its plane, which must have the same
+    shape."""
+
+    __slots__ = ("_buffer",) + tuple(
+        "_" + name for name in _COMPLEX_CHANNELS + _REAL_CHANNELS
+    )
 
     def __init__(
         self,
@@ -17,14 +55,95 @@ class Spectrum:
         quality: np.ndarray,
         preprocess: SignalProcessor,
     ) -> None:
-
+        has_quality = len(quality) > 0
+        self._set_buffer(
+            self._allocate(np.shape(antenna1), has_quality),
+            np.shape(antenna1),
+            has_quality,
+        )
         self.antenna1 = self._create_real_signal(antenna1, preprocess)
         self.antenna2 = self._create_real_signal(antenna2, preprocess)
         self.antenna3 = self._create_real_signal(antenna3, preprocess)
         self.cross12 = self._create_complex_signal(cross12, preprocess)
         self.cross13 = self._create_complex_signal(cross13, preprocess)
         self.cross23 = self._create_complex_signal(cross23, preprocess)
-        self.quality = self._create_real_signal(quality, preprocess)
+        if has_quality:
+            self.quality = self._create_real_signal(quality, preprocess)
+
+    @classmethod
+    def from_buffer(
+        cls, buffer, shape: Tuple[int, int], has_quality: bool
+    ) -> "Spectrum":
+        """Wraps an existing buffer laid out as described above, without
+        copying.  The spectrum is read-only if the buffer is"""
+        spectrum = cls.__new__(cls)
+        buffer = np.frombuffer(buffer, dtype=np.uint8)
+        expected = cls._buffer_size(shape, has_quality)
+        if buffer.size != expected:
+            raise ValueError(
+                "Buffer holds {} bytes, expected {}".format(
+                    buffer.size, expected
+                )
+            )
+        spectrum._set_buffer(buffer, shape, has_quality)
+        return spectrum
+
+    @staticmethod
+    def _buffer_size(shape: Tuple[int, int], has_quality: bool) -> int:
+        num_range, num_doppler = shape
+        num_real = len(_REAL_CHANNELS) - (0 if has_quality else 1)
+        plane = num_range * num_doppler
+        return plane * (len(_COMPLEX_CHANNELS) * 8 + num_real * 4)
+
+    def _allocate(self, shape: Tuple[int, int], has_quality: bool):
+        return np.empty(self._buffer_size(shape, has_quality), dtype=np.uint8)
+
+    def _set_buffer(
+        self, buffer: np.ndarray, shape: Tuple[int, int], has_quality: bool
+    ) -> None:
+        num_range, num_doppler = shape
+        plane = num_range * num_doppler
+        offset = 0
+        for name in _COMPLEX_CHANNELS:
+            view = buffer[offset : offset + plane * 8].view(np.complex64)
+            setattr(self, "_" + name, view.reshape(shape))
+            offset += plane * 8
+        for name in _REAL_CHANNELS:
+            if name == "quality" and not has_quality:
+                shape = (0, num_doppler)
+                plane = 0
+            view = buffer[offset : offset + plane * 4].view(np.float32)
+            setattr(self, "_" + name, view.reshape(shape))
+            offset += plane * 4
+        self._buffer = buffer
+
+    antenna1 = _channel("antenna1", "Spectrum from first loop antenna")
+    antenna2 = _channel("antenna2", "Spectrum from second loop antenna")
+    antenna3 = _channel("antenna3", "Spectrum from monopole antenna")
+    cross12 = _channel("cross12", "Cross-spectrum from antenna 1 & 2.")
+    cross13 = _channel("cross13", "Cross-spectrum from antenna 1 & 3.")
+    cross23 = _channel("cross23", "Cross-spectrum from antenna 2 & 3.")
+    quality = _channel(
+        "quality", "Quality data, with no range cells if the file has none"
+    )
+
+    @property
+    def buffer(self) -> np.ndarray:
+        """Contiguous bytes backing every channel"""
+        return self._buffer
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """(num_range, num_doppler) of each channel"""
+        return self._antenna1.shape
+
+    @property
+    def has_quality(self) -> bool:
+        return self._quality.shape[0] > 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.nbytes
 
     def _create_real_signal(
         self, raw: np.ndarray, preprocess: SignalProcessor
@@ -37,3 +156,11 @@ class Spectrum:
         real = preprocess(raw.real)
         imag = preprocess(raw.imag)
         return real + 1j * imag
+
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        """With pickle protocol 5 the buffer is passed as a PickleBuffer, so
+        it can be sent out-of-band without being copied into the pickle"""
+        buffer = self._buffer
+        if protocol >= 5:
+            buffer = pickle.PickleBuffer(buffer)
+        return (self.from_buffer, (buffer, self.shape, self.has_quality))
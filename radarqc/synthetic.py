@@ -0,0 +1,134 @@
+import datetime
+
+from collections import OrderedDict
+from typing import BinaryIO, Dict
+
+import numpy as np
+
+from radarqc.csfile import CSFile, dump
+from radarqc.header import CSFileHeader
+from radarqc.processing import Identity
+from radarqc.spectrum import Spectrum
+
+
+def _default_blocks() -> Dict[str, bytes]:
+    return OrderedDict(
+        [
+            ("TIME", bytes(8)),
+            ("ZONE", b"UTC\x00"),
+        ]
+    )
+
+
+def create_header(
+    num_range_cells: int = 32,
+    num_doppler_cells: int = 512,
+    cskind: int = 2,
+    timestamp: datetime.datetime = None,
+    site_code: str = "SYNT",
+    blocks: Dict[str, bytes] = None,
+) -> CSFileHeader:
+    """Creates a valid version 6 header for a synthetic Cross-Spectrum file.
+    `blocks` maps four character keys to the raw bytes of each v6 block"""
+    if len(site_code) != 4:
+        raise ValueError("site_code must be 4 characters")
+
+    header = CSFileHeader()
+    header.version = 6
+    header.timestamp = timestamp or datetime.datetime(2021, 6, 26, 14)
+    header.cskind = cskind
+    header.site_code = site_code
+    header.cover_minutes = 60
+    header.deleted_source = False
+    header.override_source = False
+    header.start_freq_mhz = 4.54
+    header.rep_freq_mhz = 2.0
+    header.bandwidth_khz = 25.7
+    header.sweep_up = True
+    header.num_doppler_cells = num_doppler_cells
+    header.num_range_cells = num_range_cells
+    header.first_range_cell = 1
+    header.range_cell_dist_km = 5.83
+    header.output_interval = 60
+    header.create_type_code = "SYNT"
+    header.creator_version = "0.1 "
+    header.num_active_channels = 3
+    header.num_spectra_channels = 3
+    header.active_channels = 0b111
+    if blocks is None:
+        blocks = _default_blocks()
+    header.blocks = OrderedDict(blocks)
+    return header
+
+
+def create_spectrum(
+    header: CSFileHeader, rng: np.random.Generator = None
+) -> Spectrum:
+    """Creates spectra shaped like sea echo: an exponentially distributed
+    noise floor plus a pair of first order peaks decaying with range.
+    Cross-spectra are complex64, self-spectra and quality are float32"""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    shape = (header.num_range_cells, header.num_doppler_cells)
+    num_range, num_doppler = shape
+    doppler = np.arange(num_doppler)
+    peaks = np.zeros(num_doppler)
+    for center in (num_doppler * 3 // 8, num_doppler * 5 // 8):
+        peaks += np.exp(-0.5 * ((doppler - center) / 2) ** 2)
+    decay = np.exp(-np.arange(num_range) / max(num_range / 3, 1))
+    signal = 1e-7 * decay[:, np.newaxis] * peaks
+
+    def real():
+        noise = rng.exponential(1e-10, size=shape)
+        return (signal + noise).astype(np.float32)
+
+    def cross():
+        noise = rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+        return (signal + 1e-10 * noise).astype(np.complex64)
+
+    if header.cskind >= 2:
+        quality = rng.uniform(0, 1, size=shape).astype(np.float32)
+    else:
+        quality = []
+
+    return Spectrum(
+        real(),
+        real(),
+        real(),
+        cross(),
+        cross(),
+        cross(),
+        quality,
+        Identity(),
+    )
+
+
+def generate(
+    num_range_cells: int = 32,
+    num_doppler_cells: int = 512,
+    cskind: int = 2,
+    timestamp: datetime.datetime = None,
+    site_code: str = "SYNT",
+    blocks: Dict[str, bytes] = None,
+    seed: int = None,
+) -> CSFile:
+    """Creates a synthetic CSFile, reproducible for a given seed"""
+    header = create_header(
+        num_range_cells,
+        num_doppler_cells,
+        cskind,
+        timestamp,
+        site_code,
+        blocks,
+    )
+    spectrum = create_spectrum(header, np.random.default_rng(seed))
+    return CSFile(header, spectrum)
+
+
+def write(f: BinaryIO, **kwargs) -> CSFile:
+    """Writes a synthetic Cross-Spectrum file through CSFileWriter.  Accepts
+    the same keyword arguments as `generate`, and returns the file written"""
+    cs = generate(**kwargs)
+    dump(cs, f)
+    return cs
@@ -8,6 +8,7 @@ from typing import Any, BinaryIO
 
 import numpy as np
 
+from radarqc import profiling
 from radarqc.header import CSFileHeader
 from radarqc.serialization import BinaryWriter, ByteOrder
 from radarqc.spectrum import Spectrum
@@ -99,12 +100,14 @@ class CSFileWriter:
         self, header: CSFileHeader, spectrum: Spectrum, f: BinaryIO
     ) -> None:
         writer = BinaryWriter(f, ByteOrder.BIG_ENDIAN)
-        self._write_header_v6(header, writer)
-        self._write_spectrum_data(header, spectrum, writer)
+        with profiling.stage("writer.header") as stage:
+            stage.nbytes = self._write_header_v6(header, writer)
+        with profiling.stage("writer.spectrum") as stage:
+            stage.nbytes = self._write_spectrum_data(header, spectrum, writer)
 
     def _write_header_v6(
         self, header: CSFileHeader, writer: BinaryWriter
-    ) -> None:
+    ) -> int:
         blocks = self._serialize_blocks(header)
         header_size = self._calculate_header_size_v6(blocks)
 
@@ -158,25 +161,27 @@ class CSFileWriter:
             writer.write_uint32(len(block))
             writer.write_bytes(block)
         # end v6
+        return header_size
 
-    def _write_real_row(self, row: np.ndarray, writer: BinaryWriter) -> None:
-        dtype = np.dtype("float32").newbyteorder(">")
-        buff = row.astype(dtype=dtype)
-        writer.write_bytes(buff)
-
-    def _write_complex_row(self, row: np.ndarray, writer: BinaryWriter) -> None:
-        floats = row.view(np.float32).tolist()
-        writer.write_float(floats)
+    def _calculate_spectrum_size(self, header: CSFileHeader) -> int:
+        num_real = 4 if header.cskind >= 2 else 3
+        num_floats = num_real + 2 * 3
+        row_size = num_floats * header.num_doppler_cells * 4
+        return row_size * header.num_range_cells
 
     def _write_spectrum_data(
         self, header: CSFileHeader, spectrum: Spectrum, writer: BinaryWriter
-    ) -> None:
-        for i in range(header.num_range_cells):
-            self._write_real_row(spectrum.antenna1[i], writer)
-            self._write_real_row(spectrum.antenna2[i], writer)
-            self._write_real_row(spectrum.antenna3[i], writer)
-            self._write_complex_row(spectrum.cross12[i], writer)
-            self._write_complex_row(spectrum.cross13[i], writer)
-            self._write_complex_row(spectrum.cross23[i], writer)
-            if header.cskind >= 2:
-                self._write_real_row(spectrum.quality[i], writer)
+    ) -> int:
+        channels = [
+            spectrum.antenna1,
+            spectrum.antenna2,
+            spectrum.antenna3,
+            spectrum.cross12.view(np.float32),
+            spectrum.cross13.view(np.float32),
+            spectrum.cross23.view(np.float32),
+        ]
+        if header.cskind >= 2:
+            channels.append(spectrum.quality)
+        rows = np.concatenate(channels, axis=1)
+        writer.write_array(rows[: header.num_range_cells])
+        return self._calculate_spectrum_size(header)
@@ -10,5 +10,12 @@ setup(
     author="John Stanco",
     description="Python package for loading and processing HF radar spectra in Cross-Spectrum file format",
     long_description=long_description,
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "examples"]),
+    entry_points={
+        "console_scripts": [
+            "radarqc-batch=radarqc.batch:main",
+            "radarqc-ingest=radarqc.ingest:main",
+            "radarqc-diff=radarqc.diff:main",
+        ],
+    },
 )